@@ -0,0 +1,32 @@
+from django.core.cache import caches
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+
+USER_CACHE = 'users'
+
+
+def get_user_cache_key(user_id):
+    return f'user:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    caches[USER_CACHE].delete(get_user_cache_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    # The token is already verified, so the user row only has to come from
+    # the database on a cache miss. Only users that passed the active check
+    # are cached; core.signals.handlers evicts them whenever they change.
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        cache = caches[USER_CACHE]
+        key = get_user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(key, user)
+        return user
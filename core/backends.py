@@ -0,0 +1,52 @@
+import time
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+
+PERMISSION_CACHE = 'users'
+PERMISSION_VERSION_KEY = 'perms:version'
+
+
+def get_permission_version():
+    return caches[PERMISSION_CACHE].get_or_set(PERMISSION_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_permission_version():
+    cache = caches[PERMISSION_CACHE]
+    try:
+        cache.incr(PERMISSION_VERSION_KEY)
+    except ValueError:
+        cache.add(PERMISSION_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_permission_cache_key(user_id, is_superuser):
+    return f'perms:{user_id}:{int(is_superuser)}'
+
+
+def invalidate_cached_permissions(user_id):
+    caches[PERMISSION_CACHE].delete_many([get_permission_cache_key(user_id, flag) for flag in [False, True]])
+
+
+class CachedModelBackend(ModelBackend):
+    # Shares each user's permission set across requests. Entries are stored
+    # with the global version that core.signals.handlers bumps whenever user,
+    # group or permission assignments change, and keyed on the flags that
+    # ModelBackend itself consults. The version and the entry are read in
+    # one round trip.
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+
+        if not hasattr(user_obj, '_perm_cache'):
+            cache = caches[PERMISSION_CACHE]
+            key = get_permission_cache_key(user_obj.pk, user_obj.is_superuser)
+            cached = cache.get_many([PERMISSION_VERSION_KEY, key])
+            version = cached.get(PERMISSION_VERSION_KEY) or get_permission_version()
+            entry = cached.get(key)
+            if entry is not None and entry[0] == version:
+                perms = entry[1]
+            else:
+                perms = super().get_all_permissions(user_obj)
+                cache.set(key, (version, perms))
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
@@ -1,8 +1,37 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from store.signals import order_created
+from core.authentication import invalidate_cached_user
+from core.backends import bump_permission_version, invalidate_cached_permissions
 
 
 @receiver(order_created)
 def on_order_created(sender, **kwargs):
     # We can write the code to do something with the signal here
     print(kwargs['order'])
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def evict_cached_user(sender, **kwargs):
+    # Evict again after commit so a concurrent request can't re-cache the
+    # row as it was before this transaction. The permission set goes too,
+    # so a re-created user never inherits it.
+    user_id = kwargs['instance'].pk
+    invalidate_cached_user(user_id)
+    invalidate_cached_permissions(user_id)
+    transaction.on_commit(lambda: invalidate_cached_user(user_id))
+
+
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_permission_cache(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        bump_permission_version()
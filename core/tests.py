@@ -1,3 +1,105 @@
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from core.models import User
 
-# Create your tests here.
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', email='user@domain.com')
+        self.group = Group.objects.create(name='Customer service')
+        self.group.permissions.add(Permission.objects.get(codename='view_customer'))
+        self.user.groups.add(self.group)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+
+    def test_cached_user_is_reused(self):
+        # Warm requests skip the user row: /auth/users/me/ runs no query,
+        # /store/orders/ only the customer id and the page.
+        for url, queries in [('/auth/users/me/', 0), ('/store/orders/', 2)]:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+                with self.assertNumQueries(queries):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_changed_users_are_reloaded(self):
+        self.assertEqual(self.client.get('/auth/users/me/').data['first_name'], '')
+        self.user.first_name = 'First'
+        self.user.save()
+        self.assertEqual(self.client.get('/auth/users/me/').data['first_name'], 'First')
+
+    def test_cached_user_and_permissions_are_reused(self):
+        self.assertEqual(self.client.get('/store/customers/').status_code, 200)
+        # Warm: neither the user nor the permission joins, just the page.
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/store/customers/').status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(any('auth_permission' in query['sql'] for query in queries))
+
+    def test_revoked_permissions_apply_to_the_next_request(self):
+        self.assertEqual(self.client.get('/store/customers/').status_code, 200)
+        self.group.permissions.clear()
+        self.assertEqual(self.client.get('/store/customers/').status_code, 403)
+        self.user.groups.add(self.group)
+        self.group.permissions.add(Permission.objects.get(codename='view_customer'))
+        self.assertEqual(self.client.get('/store/customers/').status_code, 200)
+        self.user.groups.remove(self.group)
+        self.assertEqual(self.client.get('/store/customers/').status_code, 403)
+        self.user.user_permissions.add(Permission.objects.get(codename='view_customer'))
+        self.assertEqual(self.client.get('/store/customers/').status_code, 200)
+
+    def test_recreated_users_start_without_permissions(self):
+        self.assertEqual(self.client.get('/store/customers/').status_code, 200)
+        user_id = self.user.id
+        self.user.delete()
+        User.objects.create(id=user_id, username='user', email='user@domain.com')
+        self.assertEqual(self.client.get('/store/customers/').status_code, 403)
+
+    def test_deactivated_users_are_rejected(self):
+        self.assertEqual(self.client.get('/auth/users/me/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/auth/users/me/').status_code, 401)
+
+
+class CustomerClaimTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', email='user@domain.com', password='Secret-password-1')
+        self.customer_id = self.user.customer.id
+        self.client = APIClient()
+
+    def obtain(self):
+        response = self.client.post('/auth/jwt/create/', {'username': 'user', 'password': 'Secret-password-1'})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def get_orders(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+        # Warm the user cache, so only the view's own queries are left.
+        self.assertEqual(client.get('/store/orders/').status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(client.get('/store/orders/').status_code, 200)
+        return [query['sql'] for query in queries]
+
+    def test_tokens_carry_the_customer_id(self):
+        tokens = self.obtain()
+        self.assertEqual(AccessToken(tokens['access'])['customer_id'], self.customer_id)
+        response = self.client.post('/auth/jwt/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(AccessToken(response.data['access'])['customer_id'], self.customer_id)
+
+    def test_claim_replaces_the_customer_lookup(self):
+        queries = self.get_orders(self.obtain()['access'])
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(any('store_customer' in sql for sql in queries))
+
+    def test_tokens_without_the_claim_fall_back_to_a_lookup(self):
+        token = AccessToken.for_user(self.user)
+        self.assertNotIn('customer_id', token)
+        queries = self.get_orders(token)
+        self.assertEqual(len(queries), 2)
+        self.assertIn('store_customer', queries[0])
@@ -0,0 +1,35 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from likes.models import LikedItem, DailyLikeCount
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily like counts behind the leaderboard from LikedItem.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='How many days back to rebuild.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = timezone.localdate() - timedelta(days=options['days'] - 1)
+        # Likes made before created_at was recorded have no day to go in.
+        counts = LikedItem.objects \
+            .filter(created_at__isnull=False, created_at__date__gte=since) \
+            .annotate(day=TruncDate('created_at')) \
+            .values_list('content_type_id', 'object_id', 'day') \
+            .annotate(count=Count('id')) \
+            .order_by()
+
+        with transaction.atomic():
+            DailyLikeCount.objects.filter(day__gte=since).delete()
+            DailyLikeCount.objects.bulk_create((
+                DailyLikeCount(content_type_id=content_type_id, object_id=object_id, day=day, count=count)
+                for content_type_id, object_id, day, count in counts.iterator()
+            ), batch_size=options['batch_size'])
+            buckets = DailyLikeCount.objects.filter(day__gte=since).count()
+
+        self.stdout.write(self.style.SUCCESS(f'{buckets} daily like counts were rebuilt since {since}.'))
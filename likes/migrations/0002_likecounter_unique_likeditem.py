@@ -0,0 +1,66 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    duplicates = LikedItem.objects \
+        .values('user_id', 'content_type_id', 'object_id') \
+        .annotate(keep_id=Min('id'), count=Count('id')) \
+        .filter(count__gt=1)
+    for duplicate in duplicates:
+        LikedItem.objects \
+            .filter(
+                user_id=duplicate['user_id'],
+                content_type_id=duplicate['content_type_id'],
+                object_id=duplicate['object_id']
+            ) \
+            .exclude(id=duplicate['keep_id']) \
+            .delete()
+
+
+def populate_like_counters(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    LikeCounter = apps.get_model('likes', 'LikeCounter')
+    counts = LikedItem.objects \
+        .values_list('content_type_id', 'object_id') \
+        .annotate(count=Count('id')) \
+        .order_by()
+    LikeCounter.objects.bulk_create((
+        LikeCounter(content_type_id=content_type_id, object_id=object_id, count=count)
+        for content_type_id, object_id, count in counts.iterator()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='likeditem',
+            unique_together={('user', 'content_type', 'object_id')},
+        ),
+        migrations.CreateModel(
+            name='LikeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('content_type', 'object_id')},
+            },
+        ),
+        migrations.RunPython(populate_like_counters, migrations.RunPython.noop),
+    ]
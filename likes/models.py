@@ -1,11 +1,159 @@
+from datetime import timedelta
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .signals import likes_changed
+
+
+def send_unliked(content_type_id, likes):
+    # An unlike is taken off the day the like was made, so older likes
+    # drop out of the leaderboard windows they were counted in. Likes with
+    # no date were never counted in any.
+    object_ids_by_day = {}
+    for object_id, created_at in likes:
+        if created_at is None:
+            continue
+        object_ids_by_day.setdefault(timezone.localdate(created_at), set()).add(object_id)
+    for day, object_ids in object_ids_by_day.items():
+        likes_changed.send(LikedItem, content_type_id=content_type_id, object_ids=object_ids, delta=-1, day=day)
+
+
+class LikedItemManager(models.Manager):
+    def get_liked_ids(self, user, obj_type, obj_ids):
+        content_type = ContentType.objects.get_for_model(obj_type)
+
+        return set(
+            LikedItem.objects
+            .filter(user=user, content_type=content_type, object_id__in=obj_ids)
+            .values_list('object_id', flat=True)
+        )
+
+    def like(self, user, obj_type, obj_ids):
+        content_type = ContentType.objects.get_for_model(obj_type)
+
+        with transaction.atomic():
+            liked_ids = set(obj_ids) - self.get_liked_ids(user, obj_type, obj_ids)
+            LikedItem.objects.bulk_create([
+                LikedItem(user=user, content_type=content_type, object_id=obj_id)
+                for obj_id in liked_ids
+            ])
+            LikeCounter.objects.adjust(content_type.id, liked_ids, 1)
+            likes_changed.send(
+                LikedItem, content_type_id=content_type.id, object_ids=liked_ids, delta=1, day=timezone.localdate())
+        return liked_ids
+
+    def unlike(self, user, obj_type, obj_ids):
+        content_type = ContentType.objects.get_for_model(obj_type)
+
+        with transaction.atomic():
+            # Locking the rows keeps two concurrent unlikes from both
+            # decrementing the counter.
+            unliked = dict(
+                LikedItem.objects
+                .select_for_update()
+                .filter(user=user, content_type=content_type, object_id__in=obj_ids)
+                .values_list('object_id', 'created_at')
+            )
+            unliked_ids = set(unliked)
+            LikedItem.objects \
+                .filter(user=user, content_type=content_type, object_id__in=unliked_ids) \
+                .delete()
+            LikeCounter.objects.adjust(content_type.id, unliked_ids, -1)
+            send_unliked(content_type.id, unliked.items())
+        return unliked_ids
 
 
 class LikedItem(models.Model):
+    # Create and delete likes through LikedItemManager.like()/unlike() so
+    # LikeCounter stays in step.
+    objects = LikedItemManager()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+    # NULL for likes made before the date was recorded; those are left out
+    # of the leaderboard rather than counted on an invented day.
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
+
+    class Meta:
+        unique_together = [['user', 'content_type', 'object_id']]
+
+
+class LikeCounterManager(models.Manager):
+    def get_counts(self, obj_type, obj_ids):
+        content_type = ContentType.objects.get_for_model(obj_type)
+
+        counts = dict(
+            LikeCounter.objects
+            .filter(content_type=content_type, object_id__in=obj_ids)
+            .values_list('object_id', 'count')
+        )
+        return {obj_id: counts.get(obj_id, 0) for obj_id in obj_ids}
+
+    def adjust(self, content_type_id, obj_ids, delta):
+        if not obj_ids:
+            return
+        # Make sure every counter row exists, then move them all with a
+        # single F() update; both statements are safe under concurrency.
+        LikeCounter.objects.bulk_create(
+            [LikeCounter(content_type_id=content_type_id, object_id=obj_id) for obj_id in obj_ids],
+            ignore_conflicts=True
+        )
+        LikeCounter.objects \
+            .filter(content_type_id=content_type_id, object_id__in=obj_ids) \
+            .update(count=F('count') + delta)
+
+
+class LikeCounter(models.Model):
+    objects = LikeCounterManager()
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    content_object = GenericForeignKey()
+
+    class Meta:
+        unique_together = [['content_type', 'object_id']]
+
+
+class DailyLikeCountManager(models.Manager):
+    def adjust(self, content_type_id, day, obj_ids, delta):
+        if not obj_ids:
+            return
+        DailyLikeCount.objects.bulk_create(
+            [DailyLikeCount(content_type_id=content_type_id, day=day, object_id=obj_id) for obj_id in obj_ids],
+            ignore_conflicts=True
+        )
+        DailyLikeCount.objects \
+            .filter(content_type_id=content_type_id, day=day, object_id__in=obj_ids) \
+            .update(count=F('count') + delta)
+
+    def get_top(self, obj_type, days=7, limit=10):
+        # Reads only the per-day buckets of the window, never LikedItem.
+        content_type = ContentType.objects.get_for_model(obj_type)
+        since = timezone.localdate() - timedelta(days=days - 1)
+
+        return list(
+            DailyLikeCount.objects
+            .filter(content_type=content_type, day__gte=since)
+            .values('object_id')
+            .annotate(count=Sum('count'))
+            .filter(count__gt=0)
+            .order_by('-count', 'object_id')[:limit]
+        )
+
+
+class DailyLikeCount(models.Model):
+    # Likes an object received on a given day, net of later unlikes.
+    # Maintained from the likes_changed signal; `rebuild_like_leaderboard`
+    # backfills it from LikedItem.
+    objects = DailyLikeCountManager()
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [['content_type', 'day', 'object_id']]
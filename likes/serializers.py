@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from rest_framework import serializers
+from .models import LikedItem
+
+
+class ContentTypeField(serializers.CharField):
+    # Accepts the label of a likeable model such as "store.product"; see
+    # settings.LIKEABLE_MODELS. Other models are reported as missing, so
+    # the API can't be used to probe them.
+    def to_internal_value(self, data):
+        label = super().to_internal_value(data)
+        if label.lower() not in [model.lower() for model in getattr(settings, 'LIKEABLE_MODELS', [])]:
+            raise serializers.ValidationError(f'No model with the label:{label} was found!')
+        try:
+            app_label, model = label.lower().split('.')
+            content_type = ContentType.objects.get_by_natural_key(app_label, model)
+        except (ValueError, ContentType.DoesNotExist):
+            raise serializers.ValidationError(f'No model with the label:{label} was found!')
+        if content_type.model_class() is None:
+            raise serializers.ValidationError(f'No model with the label:{label} was found!')
+        return content_type
+
+
+class LikeSerializer(serializers.Serializer):
+    object_id = serializers.IntegerField()
+    count = serializers.IntegerField()
+    liked = serializers.BooleanField()
+
+
+class LikeQuerySerializer(serializers.Serializer):
+    model = ContentTypeField()
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=100)
+
+    def to_internal_value(self, data):
+        data = {'model': data.get('model'), 'ids': [value for value in data.get('ids', '').split(',') if value]}
+        return super().to_internal_value(data)
+
+
+class TopLikedSerializer(serializers.Serializer):
+    object_id = serializers.IntegerField()
+    count = serializers.IntegerField()
+
+
+class TopLikedQuerySerializer(serializers.Serializer):
+    model = ContentTypeField()
+    days = serializers.IntegerField(min_value=1, max_value=90, default=7)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class BatchLikeSerializer(serializers.Serializer):
+    model = ContentTypeField()
+    like = serializers.ListField(child=serializers.IntegerField(min_value=1), default=list, max_length=1000)
+    unlike = serializers.ListField(child=serializers.IntegerField(min_value=1), default=list, max_length=1000)
+
+    def validate(self, data):
+        if set(data['like']) & set(data['unlike']):
+            raise serializers.ValidationError('An object cannot be liked and unliked at the same time!')
+
+        model = data['model'].model_class()
+        found_ids = set(model._default_manager.filter(pk__in=data['like']).values_list('pk', flat=True))
+        missing_ids = sorted(set(data['like']) - found_ids)
+        if missing_ids:
+            raise serializers.ValidationError(
+                {'like': f"No objects with the IDs:{', '.join(map(str, missing_ids))} were found!"})
+        return data
+
+    def save(self, **kwargs):
+        user = self.context['user']
+        model = self.validated_data['model'].model_class()
+        with transaction.atomic():
+            liked_ids = LikedItem.objects.like(user, model, self.validated_data['like'])
+            unliked_ids = LikedItem.objects.unlike(user, model, self.validated_data['unlike'])
+        return {'liked': sorted(liked_ids), 'unliked': sorted(unliked_ids)}
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+
+likes_changed = Signal()
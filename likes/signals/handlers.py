@@ -0,0 +1,25 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from likes.models import LikedItem, LikeCounter, DailyLikeCount, send_unliked
+from likes.signals import likes_changed
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def release_likes_of_deleted_user(sender, **kwargs):
+    # The user's likes go away by cascade, which bypasses LikedItemManager.
+    likes = defaultdict(list)
+    for content_type_id, object_id, created_at in LikedItem.objects \
+            .filter(user=kwargs['instance']) \
+            .values_list('content_type_id', 'object_id', 'created_at'):
+        likes[content_type_id].append((object_id, created_at))
+
+    for content_type_id, content_type_likes in likes.items():
+        LikeCounter.objects.adjust(content_type_id, {object_id for object_id, _ in content_type_likes}, -1)
+        send_unliked(content_type_id, content_type_likes)
+
+
+@receiver(likes_changed)
+def update_daily_like_counts(sender, **kwargs):
+    DailyLikeCount.objects.adjust(kwargs['content_type_id'], kwargs['day'], kwargs['object_ids'], kwargs['delta'])
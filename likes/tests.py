@@ -1,3 +1,130 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+from core.models import User
+from likes.models import DailyLikeCount, LikedItem, LikeCounter
+from store.models import Collection, Product
 
-# Create your tests here.
+
+class LikeCounterTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = Product.objects.bulk_create([
+            Product(title=f'Product {i}', slug='product', unit_price=Decimal(10), inventory=10, collection=collection)
+            for i in range(3)
+        ])
+        self.ids = [product.id for product in self.products]
+        self.users = [User.objects.create(username=f'user{i}', email=f'user{i}@domain.com') for i in range(2)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def batch(self, **data):
+        return self.client.post('/likes/batch/', {'model': 'store.product', **data}, format='json')
+
+    def counts(self):
+        return LikeCounter.objects.get_counts(Product, self.ids)
+
+    def test_like_and_unlike(self):
+        first, second, third = self.ids
+        LikedItem.objects.like(self.users[1], Product, [first])
+        response = self.batch(like=[first, second])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'liked': [first, second], 'unliked': []})
+        self.assertEqual(self.counts(), {first: 2, second: 1, third: 0})
+
+        # Liking twice is a no-op; so is unliking something not liked.
+        response = self.batch(like=[first], unlike=[second, third])
+        self.assertEqual(response.data, {'liked': [], 'unliked': [second]})
+        self.assertEqual(self.counts(), {first: 2, second: 0, third: 0})
+
+    def test_page_lookup(self):
+        first, second, third = self.ids
+        LikedItem.objects.like(self.users[0], Product, [first])
+        LikedItem.objects.like(self.users[1], Product, [first, second])
+        with self.assertNumQueries(2):
+            response = self.client.get('/likes/', {'model': 'store.product', 'ids': f'{first},{second},{third}'})
+        self.assertEqual(response.data, [
+            {'object_id': first, 'count': 2, 'liked': True},
+            {'object_id': second, 'count': 1, 'liked': False},
+            {'object_id': third, 'count': 0, 'liked': False},
+        ])
+
+    def test_deleted_users_release_their_likes(self):
+        LikedItem.objects.like(self.users[1], Product, self.ids[:2])
+        self.users[1].delete()
+        self.assertEqual(self.counts(), dict.fromkeys(self.ids, 0))
+
+    def test_missing_objects_are_rejected(self):
+        response = self.batch(like=[self.ids[0], 0])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.counts(), dict.fromkeys(self.ids, 0))
+
+    def test_only_likeable_models_are_accepted(self):
+        for model in ['core.user', 'likes.likeditem', 'store']:
+            with self.subTest(model=model):
+                response = self.client.post('/likes/batch/', {'model': model, 'like': [self.users[0].id]}, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(self.client.get('/likes/', {'model': model, 'ids': '1'}).status_code, 400)
+        self.assertFalse(LikedItem.objects.exists())
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = Product.objects.bulk_create([
+            Product(title=f'Product {i}', slug='product', unit_price=Decimal(10), inventory=10, collection=collection)
+            for i in range(3)
+        ])
+        self.ids = [product.id for product in self.products]
+        self.users = [User.objects.create(username=f'user{i}', email=f'user{i}@domain.com') for i in range(3)]
+
+    def top(self, days=7):
+        return [(row['object_id'], row['count']) for row in DailyLikeCount.objects.get_top(Product, days=days)]
+
+    def rebuild(self):
+        call_command('rebuild_like_leaderboard', stdout=StringIO())
+
+    def test_likes_and_unlikes_move_the_buckets(self):
+        first, second, _ = self.ids
+        for user in self.users:
+            LikedItem.objects.like(user, Product, [first])
+        LikedItem.objects.like(self.users[0], Product, [second])
+        self.assertEqual(self.top(), [(first, 3), (second, 1)])
+
+        LikedItem.objects.unlike(self.users[0], Product, [first, second])
+        self.assertEqual(self.top(), [(first, 2)])
+
+        before = self.top()
+        self.rebuild()
+        self.assertEqual(self.top(), before)
+
+    def test_likes_leave_the_window_they_were_made_in(self):
+        first, second, _ = self.ids
+        LikedItem.objects.like(self.users[0], Product, [first, second])
+        LikedItem.objects.filter(object_id=first).update(created_at=timezone.now() - timedelta(days=10))
+        self.rebuild()
+        self.assertEqual(self.top(), [(second, 1)])
+        self.assertEqual(self.top(days=30), [(first, 1), (second, 1)])
+
+        # The unlike comes off the day the like was counted on.
+        LikedItem.objects.unlike(self.users[0], Product, [first])
+        self.assertEqual(self.top(days=30), [(second, 1)])
+
+    def test_undated_likes_are_left_out(self):
+        first, second, _ = self.ids
+        LikedItem.objects.like(self.users[0], Product, [first])
+        LikedItem.objects.like(self.users[1], Product, [second])
+        # As for likes made before created_at was added.
+        LikedItem.objects.filter(object_id=first).update(created_at=None)
+        self.rebuild()
+        self.assertEqual(self.top(days=30), [(second, 1)])
+
+        LikedItem.objects.unlike(self.users[0], Product, [first])
+        self.users[1].delete()
+        self.assertEqual(self.top(days=30), [])
+        self.assertFalse(DailyLikeCount.objects.exclude(count=0).exists())
+        self.assertEqual(LikeCounter.objects.get_counts(Product, [first, second]), {first: 0, second: 0})
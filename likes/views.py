@@ -1,3 +1,52 @@
-from django.shortcuts import render
+from django.db import IntegrityError
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet
+from .models import LikedItem, LikeCounter, DailyLikeCount
+from .serializers import LikeSerializer, LikeQuerySerializer, TopLikedQuerySerializer, TopLikedSerializer, BatchLikeSerializer
 
-# Create your views here.
+
+class LikeViewSet(GenericViewSet):
+    serializer_class = LikeSerializer
+
+    def list(self, request):
+        # Answers "how many likes, and did I like it" for a whole page of
+        # objects: one query for the counters, one for the user's likes.
+        query = LikeQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        model = query.validated_data['model'].model_class()
+        ids = query.validated_data['ids']
+
+        counts = LikeCounter.objects.get_counts(model, ids)
+        liked_ids = set()
+        if request.user.is_authenticated:
+            liked_ids = LikedItem.objects.get_liked_ids(request.user, model, ids)
+
+        likes = [
+            {'object_id': obj_id, 'count': counts[obj_id], 'liked': obj_id in liked_ids}
+            for obj_id in ids
+        ]
+        return Response(LikeSerializer(likes, many=True).data)
+
+    @action(detail=False)
+    def top(self, request):
+        query = TopLikedQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        top = DailyLikeCount.objects.get_top(
+            query.validated_data['model'].model_class(),
+            days=query.validated_data['days'],
+            limit=query.validated_data['limit']
+        )
+        return Response(TopLikedSerializer(top, many=True).data)
+
+    @action(detail=False, methods=['POST'], permission_classes=[IsAuthenticated])
+    def batch(self, request):
+        serializer = BatchLikeSerializer(data=request.data, context={'user': request.user})
+        serializer.is_valid(raise_exception=True)
+        try:
+            result = serializer.save()
+        except IntegrityError:
+            return Response({"error": "The likes were changed by another request, please try again."}, status=status.HTTP_409_CONFLICT)
+        return Response(result)
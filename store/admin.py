@@ -1,6 +1,7 @@
 from django.contrib import admin, messages
 from django.db.models.aggregates import Count
 from django.db.models.query import QuerySet
+from django.utils import timezone
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 from . import models
@@ -46,7 +47,7 @@ class ProductAdmin(admin.ModelAdmin):
 
     @admin.action(description='Clear inventory')
     def clear_inventory(self, request, queryset):
-        updated_count = queryset.update(inventory=0)
+        updated_count = queryset.update(inventory=0, last_update=timezone.now())
         self.message_user(
             request,
             f'{updated_count} products were successfully updated.',
@@ -60,7 +61,7 @@ class CollectionAdmin(admin.ModelAdmin):
     list_display = ['title', 'products_count']
     search_fields = ['title']
 
-    @admin.display(ordering='products_count')
+    @admin.display(ordering='product_count')
     def products_count(self, collection):
         url = (
             reverse('admin:store_product_changelist')
@@ -68,12 +69,7 @@ class CollectionAdmin(admin.ModelAdmin):
             + urlencode({
                 'collection__id': str(collection.id)
             }))
-        return format_html('<a href="{}">{} Products</a>', url, collection.products_count)
-
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            products_count=Count('products')
-        )
+        return format_html('<a href="{}">{} Products</a>', url, collection.product_count)
 
 
 @admin.register(models.Customer)
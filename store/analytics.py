@@ -0,0 +1,151 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import Order, OrderItem, ProductDailySales, CollectionDailySales, SalesRollupCheckpoint, line_total
+
+
+# Orders younger than this are left for the next run, so an order whose
+# checkout transaction commits after a higher id is never skipped.
+SETTLE_TIME = timedelta(minutes=5)
+
+
+def rollup_sales(batch_size=1000):
+    rolled_up = 0
+    while True:
+        # The checkpoint advances in the same transaction as the totals, so
+        # a crashed or repeated run never counts an order twice.
+        with transaction.atomic():
+            checkpoint = _lock_checkpoint()
+            orders = _get_settled_orders(checkpoint.last_order_id, batch_size)
+            if not orders:
+                break
+
+            # Like CustomerStats, only completed orders count as revenue;
+            # adjust_order_sales() follows payments made after this run.
+            _add_order_totals([order_id for order_id, payment_status in orders
+                               if payment_status == Order.PAYMENT_STATUS_COMPLETE])
+            checkpoint.last_order_id = orders[-1][0]
+            checkpoint.save()
+
+        rolled_up += len(orders)
+    return rolled_up
+
+
+def adjust_order_sales(order_id, sign):
+    # Applies a payment status change (see Order.payment_status_sign) to
+    # an order the rollups already went past; later orders are counted
+    # with their status at the time rollup_sales reaches them.
+    if not sign:
+        return
+    with transaction.atomic():
+        checkpoint = _lock_checkpoint()
+        if order_id <= checkpoint.last_order_id:
+            _add_order_totals([order_id], sign)
+
+
+def get_sales(start, end, group_by='day', collection=None, product=None, limit=100):
+    # Served from the rollups only; totals are as of the last rollup_sales run.
+    if product is not None or group_by == 'product':
+        queryset = ProductDailySales.objects.all()
+        if product is not None:
+            queryset = queryset.filter(product_id=product)
+        if collection is not None:
+            queryset = queryset.filter(product__collection_id=collection)
+    else:
+        queryset = CollectionDailySales.objects.all()
+        if collection is not None:
+            queryset = queryset.filter(collection_id=collection)
+
+    queryset = queryset.filter(day__range=(start, end))
+    totals = queryset.aggregate(units=Sum('units'), revenue=Sum('revenue'))
+
+    if group_by == 'day':
+        results = queryset.values('day').order_by('day')
+    else:
+        key = f'{group_by}_id'
+        if group_by == 'collection' and queryset.model is ProductDailySales:
+            # A product filter reads the product rollup, which only knows
+            # the collection through the product.
+            results = queryset.values(**{key: F('product__collection_id')})
+        else:
+            results = queryset.values(key)
+        results = results.order_by('-revenue', key)
+    results = results.annotate(units=Sum('units'), revenue=Sum('revenue'))[:limit]
+
+    return {
+        'start': start,
+        'end': end,
+        'group_by': group_by,
+        'units': totals['units'] or 0,
+        'revenue': totals['revenue'] or 0,
+        'results': list(results),
+    }
+
+
+def _lock_checkpoint():
+    SalesRollupCheckpoint.objects.bulk_create([SalesRollupCheckpoint(pk=1)], ignore_conflicts=True)
+    return SalesRollupCheckpoint.objects.select_for_update().get(pk=1)
+
+
+def _get_settled_orders(last_order_id, batch_size):
+    cutoff = timezone.now() - SETTLE_TIME
+    settled = []
+    orders = Order.objects \
+        .filter(pk__gt=last_order_id) \
+        .order_by('pk') \
+        .values_list('id', 'placed_at', 'payment_status')[:batch_size]
+    for order_id, placed_at, payment_status in orders:
+        if placed_at > cutoff:
+            break
+        settled.append((order_id, payment_status))
+    return settled
+
+
+def _add_order_totals(order_ids, sign=1):
+    rows = OrderItem.objects \
+        .filter(order_id__in=order_ids) \
+        .order_by() \
+        .values('product_id', 'product__collection_id', day=TruncDate('order__placed_at')) \
+        .annotate(units=Sum('quantity'), revenue=Sum(line_total(price='unit_price')))
+
+    product_totals = defaultdict(lambda: [0, 0])
+    collection_totals = defaultdict(lambda: [0, 0])
+    for row in rows:
+        for totals, key in [
+            (product_totals, (row['product_id'], row['day'])),
+            (collection_totals, (row['product__collection_id'], row['day'])),
+        ]:
+            totals[key][0] += sign * row['units']
+            totals[key][1] += sign * row['revenue']
+
+    _merge_totals(ProductDailySales, 'product_id', product_totals)
+    _merge_totals(CollectionDailySales, 'collection_id', collection_totals)
+
+
+def _merge_totals(model, key_field, totals):
+    # Only rollup_sales writes these tables and it holds the checkpoint
+    # lock, so a read-modify-write is safe here.
+    existing = {
+        (getattr(row, key_field), row.day): row
+        for row in model.objects.filter(**{
+            f'{key_field}__in': {key for key, _ in totals},
+            'day__in': {day for _, day in totals},
+        })
+    }
+
+    created = []
+    updated = []
+    for (key, day), (units, revenue) in totals.items():
+        row = existing.get((key, day))
+        if row is None:
+            created.append(model(**{key_field: key}, day=day, units=units, revenue=revenue))
+        else:
+            row.units += units
+            row.revenue += revenue
+            updated.append(row)
+
+    model.objects.bulk_create(created)
+    model.objects.bulk_update(updated, ['units', 'revenue'])
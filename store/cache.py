@@ -0,0 +1,112 @@
+import hashlib
+import threading
+import time
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe, urlencode
+from rest_framework.response import Response
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+VALIDATOR_HEADERS = ['ETag', 'Last-Modified']
+
+
+class CatalogCache:
+    # Entries are written under the current catalog version, so bumping the
+    # version invalidates everything at once and stale entries simply age
+    # out of the LRU backend. The entries are per worker, but the version
+    # lives in a shared cache so a bump from any worker reaches all of them.
+    def __init__(self, alias='catalog', version_alias='default'):
+        self.alias = alias
+        self.version_alias = version_alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def version_cache(self):
+        return caches[self.version_alias]
+
+    def get_version(self):
+        # Seeding from the clock keeps a re-created version key from
+        # colliding with entries written before it was evicted.
+        return self.version_cache.get_or_set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+    def bump_version(self):
+        try:
+            self.version_cache.incr(CATALOG_VERSION_KEY)
+        except ValueError:
+            self.version_cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+    def bump_version_on_commit(self, using=None):
+        # Bump again after commit so a request that read the old rows while
+        # the transaction was open can't leave them cached.
+        self.bump_version()
+        transaction.on_commit(self.bump_version, using=using)
+
+    def make_key(self, request, action, **kwargs):
+        query = urlencode(sorted(
+            (key, sorted(values)) for key, values in request.query_params.lists()
+        ), doseq=True)
+        raw = f'{request.get_host()}|{action}|{kwargs.get("pk", "")}|{query}'
+        return 'catalog:' + hashlib.md5(raw.encode()).hexdigest()
+
+    def get(self, key, version):
+        data = self.cache.get(key, version=version)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, key, data, version):
+        self.cache.set(key, data, version=version)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+catalog_cache = CatalogCache()
+
+
+class CatalogCacheMixin:
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+
+        # Read the version before rendering so a concurrent bump leaves the
+        # freshly rendered data under the old, already-invalidated version.
+        version = catalog_cache.get_version()
+        key = catalog_cache.make_key(request, self.action, **kwargs)
+        cached = catalog_cache.get(key, version)
+        if cached is not None:
+            # The validators are cached with the data (see ConditionalGetMixin),
+            # so hits still answer conditional requests without a query.
+            data, headers = cached
+            response = get_conditional_response(
+                request,
+                etag=headers.get('ETag'),
+                last_modified=parse_http_date_safe(headers.get('Last-Modified'))
+            ) or Response(data)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            headers = {header: response[header] for header in VALIDATOR_HEADERS if header in response}
+            catalog_cache.set(key, (response.data, headers), version)
+        return response
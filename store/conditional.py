@@ -0,0 +1,49 @@
+import hashlib
+from django.core.exceptions import ValidationError
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+
+class ConditionalGetMixin:
+    # Answers If-None-Match / If-Modified-Since from a cheap validator
+    # query, so a 304 is sent before the queryset is evaluated or serialized.
+    def get_validators(self, request, *args, **kwargs):
+        # Returns (version, last_modified) for the current action, or None
+        # to skip conditional handling (e.g. the object doesn't exist).
+        return None
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        try:
+            validators = self.get_validators(request, *args, **kwargs)
+        except (TypeError, ValueError, ValidationError):
+            validators = None
+        if validators is None:
+            return handler(request, *args, **kwargs)
+
+        version, last_modified = validators
+        # The URL is part of the tag, so each page, filter and host (the
+        # payload has absolute links) gets its own.
+        raw = f'{request.build_absolute_uri()}|{version}'
+        etag = quote_etag(hashlib.md5(raw.encode()).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class ConditionalListMixin(ConditionalGetMixin):
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, *args, **kwargs)
+
+
+class ConditionalRetrieveMixin(ConditionalGetMixin):
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,141 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from tags.models import TaggedItem
+from .models import Product, Order, OrderItem
+
+
+CHUNK_SIZE = 2000
+
+PRODUCT_CSV_FIELDS = [
+    'id', 'title', 'slug', 'description', 'unit_price', 'inventory', 'last_update',
+    'collection_id', 'collection_title', 'promotion_ids', 'tags',
+]
+ORDER_CSV_FIELDS = [
+    'id', 'placed_at', 'payment_status', 'customer_id',
+    'item_id', 'product_id', 'quantity', 'unit_price',
+]
+
+
+def iter_products(since=None, chunk_size=CHUNK_SIZE):
+    queryset = Product.objects.order_by()
+    if since is not None:
+        queryset = queryset.filter(last_update__gte=since)
+    queryset = queryset.values(
+        'id', 'title', 'slug', 'description', 'unit_price', 'inventory', 'last_update',
+        'collection_id', 'collection__title')
+
+    for chunk in _iter_chunks(queryset, 'last_update', chunk_size):
+        product_ids = [product['id'] for product in chunk]
+        promotions = {product_id: [] for product_id in product_ids}
+        rows = Product.promotions.through.objects \
+            .filter(product_id__in=product_ids) \
+            .values_list('product_id', 'promotion_id', 'promotion__description', 'promotion__discount')
+        for product_id, promotion_id, description, discount in rows:
+            promotions[product_id].append({'id': promotion_id, 'description': description, 'discount': discount})
+        tags = TaggedItem.objects.get_tags_for_many(Product, product_ids)
+
+        for product in chunk:
+            yield {
+                'id': product['id'],
+                'title': product['title'],
+                'slug': product['slug'],
+                'description': product['description'],
+                'unit_price': product['unit_price'],
+                'inventory': product['inventory'],
+                'last_update': product['last_update'],
+                'collection': {'id': product['collection_id'], 'title': product['collection__title']},
+                'promotions': promotions[product['id']],
+                'tags': [tag.label for tag in tags[product['id']]],
+            }
+
+
+def iter_orders(since=None, chunk_size=CHUNK_SIZE):
+    queryset = Order.objects.order_by()
+    if since is not None:
+        queryset = queryset.filter(placed_at__gte=since)
+    queryset = queryset.values('id', 'placed_at', 'payment_status', 'customer_id')
+
+    for chunk in _iter_chunks(queryset, 'placed_at', chunk_size):
+        items = {order['id']: [] for order in chunk}
+        rows = OrderItem.objects \
+            .filter(order_id__in=list(items)) \
+            .order_by('id') \
+            .values('id', 'order_id', 'product_id', 'quantity', 'unit_price')
+        for item in rows:
+            items[item.pop('order_id')].append(item)
+
+        for order in chunk:
+            yield {**order, 'items': items[order['id']]}
+
+
+def product_csv_rows(products):
+    for product in products:
+        yield [
+            product['id'], product['title'], product['slug'], product['description'],
+            product['unit_price'], product['inventory'], product['last_update'].isoformat(),
+            product['collection']['id'], product['collection']['title'],
+            ';'.join(str(promotion['id']) for promotion in product['promotions']),
+            ';'.join(product['tags']),
+        ]
+
+
+def order_csv_rows(orders):
+    # One row per order item; orders without items get a single row.
+    for order in orders:
+        head = [order['id'], order['placed_at'].isoformat(), order['payment_status'], order['customer_id']]
+        if not order['items']:
+            yield head + [''] * 4
+        for item in order['items']:
+            yield head + [item['id'], item['product_id'], item['quantity'], item['unit_price']]
+
+
+def to_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def to_csv(header, rows):
+    buffer = _LineBuffer()
+    writer = csv.writer(buffer)
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+EXPORTS = {
+    'products': (iter_products, PRODUCT_CSV_FIELDS, product_csv_rows),
+    'orders': (iter_orders, ORDER_CSV_FIELDS, order_csv_rows),
+}
+
+
+def export(kind, output='ndjson', since=None, chunk_size=CHUNK_SIZE):
+    iter_rows, csv_fields, csv_rows = EXPORTS[kind]
+    rows = iter_rows(since=since, chunk_size=chunk_size)
+    if output == 'csv':
+        return to_csv(csv_fields, csv_rows(rows))
+    return to_ndjson(rows)
+
+
+def _iter_chunks(queryset, field, chunk_size):
+    # Walks the table by (field, id) so each chunk is an index range scan
+    # and only one chunk is held in memory, whatever the table size. Rows
+    # changed mid-export move past the cursor and may be exported twice.
+    position = None
+    while True:
+        chunk = queryset.order_by(field, 'id')
+        if position is not None:
+            value, last_id = position
+            chunk = chunk.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': last_id}))
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        position = (chunk[-1][field], chunk[-1]['id'])
+
+
+class _LineBuffer:
+    # csv.writer only needs write(); returning the line lets it be yielded.
+    def write(self, value):
+        return value
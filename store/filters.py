@@ -1,11 +1,46 @@
-from django_filters.rest_framework import FilterSet
+from django.contrib.contenttypes.models import ContentType
+from django_filters.rest_framework import FilterSet, NumberFilter
+from rest_framework.filters import SearchFilter, OrderingFilter
+from tags.models import TaggedItem
 from .models import Product
+from .search import get_search_backend
 
 
 class ProductFilter(FilterSet):
+    tag = NumberFilter(method='filter_tag')
+    # Filters on the annotation added by Product.objects.with_prices().
+    effective_price__gt = NumberFilter(field_name='effective_price', lookup_expr='gt')
+    effective_price__lt = NumberFilter(field_name='effective_price', lookup_expr='lt')
+
+    def filter_tag(self, queryset, name, value):
+        tagged_ids = TaggedItem.objects \
+            .filter(tag_id=value, content_type=ContentType.objects.get_for_model(Product)) \
+            .values('object_id')
+        return queryset.filter(id__in=tagged_ids)
+
     class Meta:
         model = Product
         fields = {
             'collection_id': ['exact'],
             'unit_price': ['gt', 'lt']
         }
+
+
+class ProductSearchFilter(SearchFilter):
+    # Ranks ?search= matches through the product search index instead of
+    # LIKE '%term%' scans over title and description.
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return get_search_backend().search(queryset, query)
+
+    def get_ordering(self, request, queryset, view):
+        # Picked up by the cursor pagination: an explicit ?ordering= wins,
+        # otherwise search results come back by relevance.
+        ordering = OrderingFilter().get_ordering(request, queryset, view)
+        if ordering:
+            return ordering
+        if request.query_params.get(self.search_param, '').strip():
+            return ['-search_rank']
+        return None
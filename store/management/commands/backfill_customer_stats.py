@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from store.models import Customer, CustomerStats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes CustomerStats from orders, one chunk of customers at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        written = 0
+
+        while True:
+            with transaction.atomic():
+                # Locking the customers' stats rows keeps concurrent orders
+                # from being applied to a row that is about to be replaced.
+                customer_ids = list(
+                    Customer.objects
+                    .filter(pk__gt=last_id)
+                    .order_by('pk')
+                    .values_list('id', flat=True)[:batch_size]
+                )
+                if not customer_ids:
+                    break
+
+                list(CustomerStats.objects.select_for_update().filter(customer_id__in=customer_ids))
+                stats = CustomerStats.objects.compute(customer_ids)
+                CustomerStats.objects.filter(customer_id__in=customer_ids).delete()
+                CustomerStats.objects.bulk_create(stats.values())
+
+            written += len(customer_ids)
+            last_id = customer_ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Stats for {written} customers were written.'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.models import Customer, CustomerStats
+
+
+class Command(BaseCommand):
+    help = 'Reports customers whose CustomerStats have drifted from their orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        drifted = 0
+
+        while True:
+            customer_ids = list(
+                Customer.objects
+                .filter(pk__gt=last_id)
+                .order_by('pk')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not customer_ids:
+                break
+
+            stored = CustomerStats.objects.in_bulk(customer_ids)
+            for customer_id, expected in CustomerStats.objects.compute(customer_ids).items():
+                actual = stored.get(customer_id, CustomerStats(customer_id=customer_id))
+                if actual.differs_from(expected):
+                    drifted += 1
+                    self.stdout.write(
+                        f'Customer {customer_id}: '
+                        f'orders {actual.order_count}/{expected.order_count}, '
+                        f'paid {actual.paid_order_count}/{expected.paid_order_count}, '
+                        f'spend {actual.lifetime_spend}/{expected.lifetime_spend}, '
+                        f'last order {actual.last_order_at}/{expected.last_order_at}')
+
+            last_id = customer_ids[-1]
+
+        if drifted:
+            raise CommandError(f'{drifted} customers have drifted; run backfill_customer_stats to repair them.')
+        self.stdout.write(self.style.SUCCESS('Customer stats are consistent.'))
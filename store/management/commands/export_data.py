@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from store.export import EXPORTS, CHUNK_SIZE, export
+
+
+class Command(BaseCommand):
+    help = 'Streams products or orders as NDJSON or CSV, to stdout or a file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--output', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--since', help='Only export rows changed (products) or placed (orders) since this ISO datetime.')
+        parser.add_argument('--file', help='Write to this path instead of stdout.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if since is not None:
+            since = parse_datetime(since)
+            if since is None:
+                raise CommandError('--since must be an ISO 8601 datetime.')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        lines = export(options['kind'], output=options['output'], since=since, chunk_size=options['chunk_size'])
+        if options['file']:
+            with open(options['file'], 'w', newline='') as file:
+                file.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from store.outbox import MAX_ATTEMPTS, process_batch, get_metrics
+
+
+class Command(BaseCommand):
+    help = 'Delivers pending outbox messages (e.g. order_created) to their receivers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--lease', type=int, default=300, help='Seconds a claimed message stays reserved.')
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            processed, failed = process_batch(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+                lease=timedelta(seconds=options['lease'])
+            )
+
+            if processed or failed:
+                metrics = get_metrics(max_attempts=options['max_attempts'])
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'processed={processed} failed={failed} '
+                    f'rate={processed / elapsed:.1f}/s depth={metrics["depth"]} lag={metrics["lag"]:.1f}s '
+                    f'dead={metrics["dead"]}'
+                )
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['poll_interval'])
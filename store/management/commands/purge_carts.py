@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from store.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Deletes carts (and their items) that have had no activity for a given number of days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-days', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['ttl_days'])
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        started = time.monotonic()
+        last_id = None
+        purged = 0
+
+        while True:
+            carts = Cart.objects.filter(updated_at__lt=cutoff).order_by('pk')
+            if last_id is not None:
+                carts = carts.filter(pk__gt=last_id)
+            cart_ids = list(carts.values_list('pk', flat=True)[:batch_size])
+            if not cart_ids:
+                break
+            last_id = cart_ids[-1]
+
+            if dry_run:
+                purged += len(cart_ids)
+            else:
+                # One short transaction per batch; re-checking the cutoff
+                # spares carts that became active since they were selected.
+                with transaction.atomic():
+                    _, deleted = Cart.objects \
+                        .filter(pk__in=cart_ids, updated_at__lt=cutoff) \
+                        .delete()
+                purged += deleted.get(Cart._meta.label, 0)
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        elapsed = time.monotonic() - started
+        verb = 'would be' if dry_run else 'were'
+        self.stdout.write(self.style.SUCCESS(
+            f'{purged} carts {verb} purged in {elapsed:.1f}s ({purged / max(elapsed, 0.001):.0f} carts/s).'
+        ))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from store.cache import catalog_cache
+from store.models import Collection, Product
+
+
+class Command(BaseCommand):
+    help = 'Repairs drift in Collection.product_count, one chunk of collections at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        repaired = 0
+
+        while True:
+            with transaction.atomic():
+                collections = list(
+                    Collection.objects
+                    .select_for_update()
+                    .filter(pk__gt=last_id)
+                    .order_by('pk')
+                    .only('id', 'product_count')[:batch_size]
+                )
+                if not collections:
+                    break
+
+                counts = dict(
+                    Product.objects
+                    .filter(collection_id__in=[collection.id for collection in collections])
+                    .order_by()
+                    .values_list('collection_id')
+                    .annotate(count=Count('id'))
+                )
+                drifted = []
+                for collection in collections:
+                    count = counts.get(collection.id, 0)
+                    if collection.product_count != count:
+                        collection.product_count = count
+                        drifted.append(collection)
+                Collection.objects.bulk_update(drifted, ['product_count'])
+                if drifted:
+                    catalog_cache.bump_version_on_commit()
+
+            repaired += len(drifted)
+            last_id = collections[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f'{repaired} collections were repaired.'))
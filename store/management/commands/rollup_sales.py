@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.analytics import rollup_sales
+
+
+class Command(BaseCommand):
+    help = 'Adds orders placed since the last run to the daily sales rollups. Safe to rerun.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rolled_up = rollup_sales(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{rolled_up} orders were rolled up.'))
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.2 on 2026-10-18 03:30
+
+from django.db import migrations, models
+
+
+def reset_sales_rollups(apps, schema_editor):
+    # The rollups used to count unpaid orders too; the next rollup_sales
+    # run rebuilds them from the first order.
+    for model_name in ['ProductDailySales', 'CollectionDailySales', 'SalesRollupCheckpoint']:
+        apps.get_model('store', model_name).objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_promotion_discount_validators'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='salesrollupcheckpoint',
+            name='last_order_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(reset_sales_rollups, migrations.RunPython.noop),
+    ]
@@ -1,27 +1,147 @@
+from collections import Counter, defaultdict
+from decimal import Decimal
 from django.conf import settings
 from django.contrib import admin
-from django.core.validators import MinValueValidator
-from django.db import models
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import connections, models, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, Round
+from django.utils import timezone
 from uuid import uuid4
+from .cache import catalog_cache
 
 
 class Promotion(models.Model):
     description = models.CharField(max_length=255)
-    discount = models.FloatField()
+    # A fraction of the unit price, e.g. 0.15 for 15% off.
+    discount = models.FloatField(validators=[MinValueValidator(0), MaxValueValidator(1)])
 
 
 class Collection(models.Model):
     title = models.CharField(max_length=255)
     featured_product = models.ForeignKey(
         'Product', on_delete=models.SET_NULL, null=True, related_name='+', blank=True)
+    # Maintained by the Product signal handlers and ProductQuerySet;
+    # `recount_collections` repairs any drift.
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    last_update = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return self.title
 
+    @classmethod
+    def adjust_product_counts(cls, changes):
+        for collection_id, delta in changes.items():
+            if delta:
+                cls.objects \
+                    .filter(pk=collection_id) \
+                    .update(product_count=F('product_count') + delta, last_update=timezone.now())
+
     class Meta:
         ordering = ['title']
 
 
+def best_discount(prefix=''):
+    # The largest discount among the product's promotions, or 0. Discounts
+    # are fractions of the unit price.
+    promotions = Product.promotions.through.objects \
+        .filter(product_id=OuterRef(prefix + 'id' if prefix else 'pk')) \
+        .order_by() \
+        .values('product_id') \
+        .annotate(best=Max('promotion__discount')) \
+        .values('best')
+    # Rounded before the cast, as SQLite's CAST doesn't round to the
+    # declared places the way MySQL's does.
+    return Cast(
+        Round(Coalesce(Subquery(promotions), 0.0, output_field=models.FloatField()), 4),
+        output_field=DecimalField(max_digits=5, decimal_places=4)
+    )
+
+
+def effective_price(prefix=''):
+    # Must match store.pricing.get_effective_price(), the Python version.
+    return Round(
+        F(prefix + 'unit_price') * (1 - best_discount(prefix)),
+        2,
+        output_field=DecimalField(max_digits=6, decimal_places=2)
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    def with_prices(self):
+        return self.annotate(effective_price=effective_price())
+
+    # Bulk paths skip the post_save/post_delete handlers, so they keep
+    # Collection.product_count, the search index and the catalog version in
+    # step themselves.
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Collection.adjust_product_counts(Counter(obj.collection_id for obj in objs))
+            # Backends that can't return the new ids leave pk unset.
+            self._index_for_search([obj for obj in objs if obj.pk is not None])
+            catalog_cache.bump_version_on_commit(using=self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if 'collection' not in fields and 'collection_id' not in fields:
+            return super().bulk_update(objs, fields, *args, **kwargs)
+
+        with transaction.atomic(using=self.db):
+            previous = dict(
+                self.select_for_update()
+                    .filter(pk__in=[obj.pk for obj in objs])
+                    .values_list('id', 'collection_id')
+            )
+            updated_count = super().bulk_update(objs, fields, *args, **kwargs)
+            changes = Counter()
+            for obj in objs:
+                previous_id = previous.get(obj.pk)
+                if previous_id is not None and previous_id != obj.collection_id:
+                    changes[previous_id] -= 1
+                    changes[obj.collection_id] += 1
+            Collection.adjust_product_counts(changes)
+        return updated_count
+
+    def update(self, **kwargs):
+        reindex_ids = None
+        if {'title', 'description'} & set(kwargs):
+            # Taken before the update, which may change what self matches.
+            reindex_ids = list(self.values_list('pk', flat=True))
+
+        collection = kwargs.get('collection', kwargs.get('collection_id'))
+        # bulk_update() passes a per-row CASE expression and does its own
+        # bookkeeping.
+        if collection is None or hasattr(collection, 'resolve_expression'):
+            updated_count = super().update(**kwargs)
+        else:
+            collection_id = getattr(collection, 'pk', collection)
+            with transaction.atomic(using=self.db):
+                moved = Counter(
+                    self.select_for_update()
+                        .exclude(collection_id=collection_id)
+                        .values_list('collection_id', flat=True)
+                )
+                updated_count = super().update(**kwargs)
+                changes = Counter({old_id: -count for old_id, count in moved.items()})
+                changes[collection_id] += sum(moved.values())
+                Collection.adjust_product_counts(changes)
+        # bulk_update() goes through here too.
+        if reindex_ids:
+            self._index_for_search(
+                Product.objects.using(self.db).filter(pk__in=reindex_ids).only('id', 'title', 'description'))
+        catalog_cache.bump_version_on_commit(using=self.db)
+        return updated_count
+
+    def _index_for_search(self, products):
+        # store.search imports the models.
+        from .search import get_search_backend
+
+        products = list(products)
+        if products:
+            get_search_backend().index_many(products)
+
+
 class Product(models.Model):
     title = models.CharField(max_length=255)
     slug = models.SlugField()
@@ -34,12 +154,31 @@ class Product(models.Model):
     last_update = models.DateTimeField(auto_now=True)
     collection = models.ForeignKey(Collection, on_delete=models.PROTECT, related_name='products')
     promotions = models.ManyToManyField(Promotion, blank=True)
+    # Review summary, maintained by the Review signal handlers.
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    last_review_date = models.DateField(null=True, blank=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.title
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            models.Index(fields=['title', 'id']),
+            models.Index(fields=['unit_price', 'id']),
+            models.Index(fields=['last_update', 'id']),
+        ]
+
+
+class ProductSearchTerm(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [['term', 'product']]
 
 
 class Customer(models.Model):
@@ -76,6 +215,112 @@ class Customer(models.Model):
         ]
 
 
+class CustomerStatsManager(models.Manager):
+    def adjust(self, customer_id, order_count=0, paid_order_count=0, lifetime_spend=0, last_order_at=None):
+        # Insert-if-missing, then apply the deltas with F() so concurrent
+        # orders for the same customer don't lose updates.
+        self.bulk_create([self.model(customer_id=customer_id)], ignore_conflicts=True)
+        updates = {
+            'order_count': F('order_count') + order_count,
+            'paid_order_count': F('paid_order_count') + paid_order_count,
+            'lifetime_spend': F('lifetime_spend') + lifetime_spend,
+        }
+        if last_order_at is not None:
+            last_order_at = Value(last_order_at)
+            updates['last_order_at'] = Coalesce(Greatest('last_order_at', last_order_at), last_order_at)
+        self.filter(customer_id=customer_id).update(**updates)
+
+    def compute(self, customer_ids):
+        # Recomputes the stats of the given customers from their orders;
+        # used by `backfill_customer_stats` and `check_customer_stats`.
+        stats = {customer_id: self.model(customer_id=customer_id) for customer_id in customer_ids}
+        orders = Order.objects \
+            .filter(customer_id__in=customer_ids) \
+            .order_by() \
+            .values('customer_id') \
+            .annotate(
+                order_count=Count('id'),
+                paid_order_count=Count('id', filter=Q(payment_status=Order.PAYMENT_STATUS_COMPLETE)),
+                last_order_at=Max('placed_at'))
+        for row in orders:
+            customer_stats = stats[row['customer_id']]
+            customer_stats.order_count = row['order_count']
+            customer_stats.paid_order_count = row['paid_order_count']
+            customer_stats.last_order_at = row['last_order_at']
+
+        spend = OrderItem.objects \
+            .filter(order__customer_id__in=customer_ids, order__payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+            .order_by() \
+            .values_list('order__customer_id') \
+            .annotate(total=Sum(line_total(price='unit_price')))
+        for customer_id, total in spend:
+            stats[customer_id].lifetime_spend = total
+        return stats
+
+
+class CustomerStats(models.Model):
+    # Maintained by the Order and OrderItem signal handlers and
+    # OrderQuerySet; only orders with a complete payment count towards the
+    # spend. check_customer_stats reports drift from any other bulk write.
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    order_count = models.PositiveIntegerField(default=0)
+    paid_order_count = models.PositiveIntegerField(default=0)
+    lifetime_spend = models.DecimalField(max_digits=11, decimal_places=2, default=0)
+    last_order_at = models.DateTimeField(null=True, blank=True)
+
+    objects = CustomerStatsManager()
+
+    @property
+    def average_order_value(self):
+        if not self.paid_order_count:
+            return Decimal(0)
+        return (self.lifetime_spend / self.paid_order_count).quantize(Decimal('0.01'))
+
+    def differs_from(self, other):
+        return any(
+            getattr(self, field) != getattr(other, field)
+            for field in ['order_count', 'paid_order_count', 'lifetime_spend', 'last_order_at']
+        )
+
+
+class OrderQuerySet(models.QuerySet):
+    def totals(self):
+        return dict(
+            OrderItem.objects
+            .filter(order__in=self)
+            .order_by()
+            .values_list('order_id')
+            .annotate(total=Sum(line_total(price='unit_price')))
+        )
+
+    def update(self, **kwargs):
+        # Bulk status changes skip the post_save handler, so they move the
+        # affected orders in and out of CustomerStats' spend themselves.
+        payment_status = kwargs.get('payment_status')
+        if payment_status is None:
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db):
+            changed = list(
+                self.select_for_update()
+                    .exclude(payment_status=payment_status)
+                    .values_list('id', 'customer_id', 'payment_status')
+            )
+            updated_count = super().update(**kwargs)
+
+            totals = Order.objects.filter(pk__in=[order_id for order_id, _, _ in changed]).totals()
+            changes = defaultdict(lambda: [0, 0])
+            for order_id, customer_id, previous_status in changed:
+                sign = Order.payment_status_sign(previous_status, payment_status)
+                if sign:
+                    changes[customer_id][0] += sign
+                    changes[customer_id][1] += sign * totals.get(order_id, 0)
+            for customer_id, (paid_order_count, lifetime_spend) in changes.items():
+                CustomerStats.objects.adjust(
+                    customer_id, paid_order_count=paid_order_count, lifetime_spend=lifetime_spend)
+        return updated_count
+
+
 class Order(models.Model):
     PAYMENT_STATUS_PENDING = 'P'
     PAYMENT_STATUS_COMPLETE = 'C'
@@ -91,7 +336,18 @@ class Order(models.Model):
         max_length=1, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_STATUS_PENDING)
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
 
+    objects = OrderQuerySet.as_manager()
+
+    @classmethod
+    def payment_status_sign(cls, previous_status, payment_status):
+        # +1 when an order starts counting towards the customer's spend,
+        # -1 when it stops, 0 otherwise.
+        return (payment_status == cls.PAYMENT_STATUS_COMPLETE) - (previous_status == cls.PAYMENT_STATUS_COMPLETE)
+
     class Meta:
+        indexes = [
+            models.Index(fields=['placed_at', 'id']),
+        ]
         permissions = [
             ('cancel_order', 'Can cancel order'),
         ]
@@ -111,18 +367,81 @@ class Address(models.Model):
         Customer, on_delete=models.CASCADE)
 
 
+def line_total(prefix='', price=None):
+    # Cart lines are priced live with promotions applied; order lines pass
+    # price='unit_price' to use the price stored at checkout.
+    price = effective_price(prefix + 'product__') if price is None else F(prefix + price)
+    return ExpressionWrapper(
+        F(prefix + 'quantity') * price,
+        output_field=DecimalField(max_digits=11, decimal_places=2)
+    )
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        return self.annotate(
+            item_count=Coalesce(Sum('items__quantity'), 0),
+            total_price=Coalesce(Sum(line_total('items__')), 0, output_field=DecimalField(max_digits=11, decimal_places=2))
+        )
+
+
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = CartQuerySet.as_manager()
+
+    @classmethod
+    def touch(cls, cart_id):
+        cls.objects.filter(pk=cart_id).update(updated_at=timezone.now())
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_total_price(self):
+        return self.annotate(total_price=line_total())
+
+    def add_quantities(self, cart_id, quantities):
+        # Insert-or-increment every (product_id, quantity) pair in one
+        # statement, so concurrent adds neither lose updates nor trip the
+        # (cart, product) unique constraint. Quantities are capped at
+        # CartItem.MAX_QUANTITY instead of overflowing the column.
+        connection = connections[self.db]
+        opts = self.model._meta
+        table = connection.ops.quote_name(opts.db_table)
+        cart_id = opts.get_field('cart').get_db_prep_value(cart_id, connection)
+        max_quantity = self.model.MAX_QUANTITY
+
+        rows = ', '.join(['(%s, %s, %s)'] * len(quantities))
+        params = []
+        for product_id, quantity in quantities.items():
+            params += [cart_id, product_id, min(quantity, max_quantity)]
+
+        if connection.vendor == 'mysql':
+            sql = f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES {rows} ' \
+                  f'ON DUPLICATE KEY UPDATE quantity = LEAST(quantity + VALUES(quantity), %s)'
+        else:
+            least = 'MIN' if connection.vendor == 'sqlite' else 'LEAST'
+            sql = f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES {rows} ' \
+                  f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {least}({table}.quantity + excluded.quantity, %s)'
+        params.append(max_quantity)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
 
 
 class CartItem(models.Model):
+    # The largest quantity a PositiveSmallIntegerField holds on every backend.
+    MAX_QUANTITY = 32767
+
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField(
         validators=[MinValueValidator(1)]
     )
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = [['cart', 'product']]
 
@@ -132,3 +451,51 @@ class Review(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
     date = models.DateField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'date']),
+        ]
+
+
+class OutboxMessage(models.Model):
+    event = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'available_at']),
+        ]
+
+
+class ProductDailySales(models.Model):
+    # Rolled up from OrderItem by `rollup_sales` (see store.analytics).
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['day', 'product']]
+
+
+class CollectionDailySales(models.Model):
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = [['day', 'collection']]
+
+
+class SalesRollupCheckpoint(models.Model):
+    # High-water mark of `rollup_sales`: every order up to and including
+    # last_order_id is already counted in the daily sales tables.
+    last_order_id = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
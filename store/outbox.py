@@ -0,0 +1,86 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from .models import Order, OutboxMessage
+from .signals import order_created
+
+
+ORDER_CREATED = 'order_created'
+MAX_ATTEMPTS = 10
+
+
+def enqueue(event, **payload):
+    # Must be called inside the transaction that produced the event, so the
+    # message commits (or rolls back) together with it.
+    return OutboxMessage.objects.create(event=event, payload=payload)
+
+
+def deliver_order_created(payload):
+    from .serializers import CreateOrderSerializer
+
+    order = Order.objects.get(pk=payload['order_id'])
+    return order_created.send_robust(CreateOrderSerializer, order=order)
+
+
+HANDLERS = {
+    ORDER_CREATED: deliver_order_created,
+}
+
+
+def claim_batch(batch_size, max_attempts, lease):
+    # Claimed messages are leased rather than held under a row lock, so
+    # receivers run outside any transaction. If the worker dies mid-batch
+    # the lease expires and another worker picks them up again.
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects
+            .select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, available_at__lte=now, attempts__lt=max_attempts)
+            .order_by('id')[:batch_size]
+        )
+        OutboxMessage.objects \
+            .filter(pk__in=[message.id for message in messages]) \
+            .update(available_at=now + lease)
+    return messages
+
+
+def process_batch(batch_size=100, max_attempts=MAX_ATTEMPTS, lease=timedelta(minutes=5)):
+    processed = failed = 0
+
+    for message in claim_batch(batch_size, max_attempts, lease):
+        message.attempts += 1
+        try:
+            responses = HANDLERS[message.event](message.payload)
+            errors = [repr(response) for _, response in responses if isinstance(response, Exception)]
+        except Exception as error:
+            errors = [repr(error)]
+
+        if errors:
+            failed += 1
+            message.last_error = '\n'.join(errors)
+            # Messages that reach max_attempts are no longer claimed and stay
+            # unprocessed for inspection.
+            backoff = min(2 ** message.attempts, 3600)
+            message.available_at = timezone.now() + timedelta(seconds=backoff)
+        else:
+            processed += 1
+            message.processed_at = timezone.now()
+
+        message.save(update_fields=['attempts', 'last_error', 'available_at', 'processed_at'])
+
+    return processed, failed
+
+
+def get_metrics(max_attempts=MAX_ATTEMPTS):
+    # Dead messages (out of attempts) are never delivered, so they are
+    # counted on their own instead of inflating depth and pinning lag.
+    unprocessed = OutboxMessage.objects.filter(processed_at__isnull=True)
+    pending = unprocessed.filter(attempts__lt=max_attempts)
+    oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+    return {
+        'depth': pending.count(),
+        'lag': (timezone.now() - oldest).total_seconds() if oldest else 0,
+        'dead': unprocessed.filter(attempts__gte=max_attempts).count(),
+    }
@@ -1,6 +1,181 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import b64decode, b64encode
+from collections import namedtuple
+from urllib import parse
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+Cursor = namedtuple('Cursor', ['reverse', 'position'])
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 10
-    
\ No newline at end of file
+
+
+class KeysetPagination(CursorPagination):
+    # Unlike DRF's CursorPagination, which keys on the first ordering field
+    # and falls back to OFFSET for duplicates, the cursor here stores the
+    # full (field, ..., id) tuple so every page is a single index range scan.
+    page_size = 10
+    tiebreaker = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if self.tiebreaker not in [order.lstrip('-') for order in ordering]:
+            prefix = '-' if ordering[0].startswith('-') else ''
+            ordering += (prefix + self.tiebreaker,)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.ordering_fields = [self._get_ordering_field(queryset, order.lstrip('-')) for order in self.ordering]
+        self.cursor = self.decode_cursor(request)
+        reverse, position = self.cursor or (False, None)
+
+        ordering = self._reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = self._load_ordering_fields(queryset.order_by(*ordering), ordering)
+        if position is not None:
+            queryset = queryset.filter(self._get_keyset_filter(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > len(self.page)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[-1], self.ordering)
+        else:
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(self.page[0], self.ordering)
+        else:
+            position = self.cursor.position
+        return self.encode_cursor(Cursor(reverse=True, position=position))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            position = tokens['p']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        # Cursors come back from clients, so every value is parsed and
+        # validated as its field before it reaches the keyset filter.
+        try:
+            position = [
+                self._parse_position_value(field, value)
+                for field, value in zip(self.ordering_fields, position)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        return Cursor(reverse=reverse, position=position)
+
+    def encode_cursor(self, cursor):
+        reverse, position = cursor
+        tokens = {'p': position}
+        if reverse:
+            tokens['r'] = '1'
+
+        querystring = parse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def _get_position_from_instance(self, instance, ordering):
+        position = []
+        for order in ordering:
+            field_name = order.lstrip('-')
+            if isinstance(instance, dict):
+                attr = instance[field_name]
+            else:
+                attr = getattr(instance, field_name)
+            position.append(str(attr))
+        return position
+
+    def _get_ordering_field(self, queryset, field_name):
+        annotation = queryset.query.annotations.get(field_name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(field_name)
+
+    def _parse_position_value(self, field, value):
+        value = field.to_python(value)
+        field.run_validators(value)
+        return value
+
+    def _get_keyset_filter(self, ordering, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        keyset_filter = Q()
+        equal = Q()
+        for order, value in zip(ordering, position):
+            field_name = order.lstrip('-')
+            lookup = '__lt' if order.startswith('-') else '__gt'
+            keyset_filter |= equal & Q(**{field_name + lookup: value})
+            equal &= Q(**{field_name: value})
+        return keyset_filter
+
+    def _load_ordering_fields(self, queryset, ordering):
+        # Sparse fieldsets load rows with .only(); the cursor reads the
+        # ordering fields of every row, so they have to be loaded as well.
+        # (.values() querysets pick their own fields.)
+        field_names, defer = queryset.query.deferred_loading
+        if defer or queryset._fields is not None:
+            return queryset
+        concrete_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        ordering_fields = [order.lstrip('-') for order in ordering if order.lstrip('-') in concrete_fields]
+        return queryset.only(*field_names, *ordering_fields)
+
+    def _reverse_ordering(self, ordering):
+        return tuple(order[1:] if order.startswith('-') else '-' + order for order in ordering)
+
+
+class ProductPagination(KeysetPagination):
+    ordering = ('title', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class OrderPagination(KeysetPagination):
+    ordering = ('-placed_at', '-id')
+
+
+class ReviewPagination(KeysetPagination):
+    ordering = ('-date', '-id')
@@ -9,8 +9,10 @@ class IsAdminOrReadOnly(BasePermission):
 
 
 class FullDjangoModelPermissions(DjangoModelPermissions):
-    def __init__(self) -> None:
-        self.perms_map['GET'] = ['%(app_label)s.view_%(model_name)s']
+    perms_map = {
+        **DjangoModelPermissions.perms_map,
+        'GET': ['%(app_label)s.view_%(model_name)s'],
+    }
 
 
 class ViewCustomerHistoryPermission(BasePermission):
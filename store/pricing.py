@@ -0,0 +1,67 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.db.models import Max
+from .cache import catalog_cache
+from .models import Product
+
+
+# Quantized once, rather than building Decimal(1.1) from a float per row.
+TAX_MULTIPLIER = Decimal(1.1).quantize(Decimal('0.01'))
+CENT = Decimal('0.01')
+# Matches the DECIMAL(5, 4) cast in models.best_discount().
+DISCOUNT_PLACES = Decimal('0.0001')
+
+
+def get_discounts(product_ids, cached=True):
+    # Best discount per product. Hits come from the catalog cache, misses
+    # are read with one query. Entries are kept per worker under the shared
+    # catalog version, which invalidate() bumps.
+    product_ids = set(product_ids)
+    cache = catalog_cache.cache
+    discounts = {}
+    if cached:
+        version = catalog_cache.get_version()
+        found = cache.get_many([_make_key(product_id) for product_id in product_ids], version=version)
+        discounts = {product_id: found[_make_key(product_id)] for product_id in product_ids if _make_key(product_id) in found}
+
+    missing_ids = product_ids - set(discounts)
+    if missing_ids:
+        best = dict(
+            Product.promotions.through.objects
+            .filter(product_id__in=missing_ids)
+            .order_by()
+            .values('product_id')
+            .annotate(best=Max('promotion__discount'))
+            .values_list('product_id', 'best')
+        )
+        fresh = {
+            product_id: Decimal(str(best.get(product_id, 0))).quantize(DISCOUNT_PLACES, rounding=ROUND_HALF_UP)
+            for product_id in missing_ids
+        }
+        if cached:
+            cache.set_many({_make_key(product_id): discount for product_id, discount in fresh.items()}, version=version)
+        discounts.update(fresh)
+    return discounts
+
+
+def get_effective_price(unit_price, discount):
+    # Must match models.effective_price(), the SQL version.
+    return (unit_price * (1 - discount)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def get_effective_prices(products, cached=True):
+    discounts = get_discounts([product.id for product in products], cached=cached)
+    return {product.id: get_effective_price(product.unit_price, discounts[product.id]) for product in products}
+
+
+def get_price_with_tax(effective_price):
+    return effective_price * TAX_MULTIPLIER
+
+
+def invalidate():
+    # Entries live under the shared catalog version, so bumping it drops
+    # them in every worker.
+    catalog_cache.bump_version_on_commit()
+
+
+def _make_key(product_id):
+    return f'pricing:discount:{product_id}'
@@ -0,0 +1,99 @@
+import re
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import FloatField, Sum
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from .models import Product, ProductSearchTerm
+
+
+TITLE_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text):
+    max_length = ProductSearchTerm._meta.get_field('term').max_length
+    return [token[:max_length] for token in re.findall(r'\w+', (text or '').lower())]
+
+
+class InvertedIndexBackend:
+    # Portable backend: a (term, product, weight) table maintained from the
+    # Product signals. Used locally and on any database without FULLTEXT.
+    def search(self, queryset, query):
+        terms = set(tokenize(query))
+        return queryset \
+            .filter(search_terms__term__in=terms) \
+            .annotate(search_rank=Sum('search_terms__weight'))
+
+    def index(self, product):
+        self.index_many([product])
+
+    def index_many(self, products):
+        # Replaces the terms of the given products in one transaction, so
+        # searches see either their old terms or their new ones.
+        search_terms = []
+        for product in products:
+            weights = {}
+            for term in tokenize(product.title):
+                weights[term] = weights.get(term, 0) + TITLE_WEIGHT
+            for term in tokenize(product.description):
+                weights[term] = weights.get(term, 0) + DESCRIPTION_WEIGHT
+            search_terms += [
+                ProductSearchTerm(product_id=product.id, term=term, weight=weight)
+                for term, weight in weights.items()
+            ]
+
+        with transaction.atomic():
+            ProductSearchTerm.objects.filter(product_id__in=[product.id for product in products]).delete()
+            ProductSearchTerm.objects.bulk_create(search_terms)
+
+    def rebuild(self, batch_size=1000):
+        # Reindexes batch by batch instead of emptying the table first, so
+        # ?search= keeps answering while a rebuild runs. Terms of deleted
+        # products are cascaded away with them.
+        count = 0
+        last_id = 0
+        while True:
+            products = list(
+                Product.objects
+                .filter(pk__gt=last_id)
+                .order_by('pk')
+                .only('id', 'title', 'description')[:batch_size]
+            )
+            if not products:
+                return count
+            self.index_many(products)
+            count += len(products)
+            last_id = products[-1].id
+
+
+class MySQLFullTextBackend:
+    # MySQL keeps its FULLTEXT indexes (see migration 0015) up to date
+    # itself, so there is nothing to maintain here.
+    def search(self, queryset, query):
+        table = Product._meta.db_table
+        rank = RawSQL(
+            f'MATCH({table}.title) AGAINST (%s IN NATURAL LANGUAGE MODE) * %s'
+            f' + MATCH({table}.title, {table}.description) AGAINST (%s IN NATURAL LANGUAGE MODE) * %s',
+            (query, TITLE_WEIGHT - DESCRIPTION_WEIGHT, query, DESCRIPTION_WEIGHT),
+            output_field=FloatField()
+        )
+        return queryset.annotate(search_rank=rank).filter(search_rank__gt=0)
+
+    def index(self, product):
+        pass
+
+    def index_many(self, products):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        return 0
+
+
+def get_search_backend():
+    backend = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+    if backend:
+        return import_string(backend)()
+    if connection.vendor == 'mysql':
+        return MySQLFullTextBackend()
+    return InvertedIndexBackend()
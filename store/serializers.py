@@ -1,12 +1,63 @@
-from decimal import Decimal
+from datetime import timedelta
+from operator import itemgetter
 from django.db import transaction
+from django.db.models import Case, Count, F, Value, When
 from django.forms import ValidationError
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import serializers
-from store.models import Product, Collection, Review, Cart, CartItem, Customer, Order, OrderItem
-from .signals import order_created
-
-
-class CollectionSerializer(serializers.ModelSerializer):
+from rest_framework.permissions import SAFE_METHODS
+from tags.models import TaggedItem
+from store.models import Product, Collection, Review, Cart, CartItem, Customer, CustomerStats, Order, OrderItem
+from . import outbox, pricing
+
+
+PK_PLACEHOLDER = '__pk__'
+
+
+class SparseFieldsMixin:
+    # On reads, ?fields=a,b keeps only the listed fields and ?omit=c drops
+    # fields. field_sources lists the model fields a serializer field reads
+    # when they differ from its name, so views can load just those.
+    field_sources = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.get_selected_fields(self.context.get('request'))
+        if selected is not None:
+            for field_name in set(self.fields) - set(selected):
+                self.fields.pop(field_name)
+
+    @classmethod
+    def get_selected_fields(cls, request):
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        fields = request.query_params.get('fields')
+        omit = request.query_params.get('omit')
+        if not fields and not omit:
+            return None
+
+        selected = list(cls.Meta.fields)
+        if fields:
+            requested = set(fields.split(','))
+            selected = [field_name for field_name in selected if field_name in requested]
+        if omit:
+            omitted = set(omit.split(','))
+            selected = [field_name for field_name in selected if field_name not in omitted]
+        return selected
+
+    @classmethod
+    def get_model_fields(cls, field_names):
+        concrete_fields = {field.name for field in cls.Meta.model._meta.concrete_fields}
+        model_fields = []
+        for field_name in field_names:
+            for source in cls.field_sources.get(field_name, [field_name]):
+                if source in concrete_fields:
+                    model_fields.append(source)
+        return model_fields
+
+
+class CollectionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Collection
         fields = ['id', 'title', 'product_count']
@@ -14,28 +65,208 @@ class CollectionSerializer(serializers.ModelSerializer):
     product_count = serializers.IntegerField(read_only=True)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'title', 'slug', 'description', 'unit_price', 'inventory', 'price_with_tax', 'collection']
+        fields = ['id', 'title', 'slug', 'description', 'unit_price', 'effective_price', 'inventory', 'price_with_tax',
+                  'collection', 'tags', 'review_count', 'last_review_date']
+
+    field_sources = {
+        'effective_price': ['unit_price'],
+        'price_with_tax': ['unit_price'],
+        'tags': [],
+    }
 
+    effective_price = serializers.SerializerMethodField()
     price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
     collection = serializers.HyperlinkedRelatedField(
         queryset=Collection.objects.all(),
         view_name='collection-detail'
     )
+    tags = serializers.SerializerMethodField()
+
+    def get_effective_price(self, product: Product):
+        # Annotated by Product.objects.with_prices() on the read paths.
+        if not hasattr(product, 'effective_price'):
+            product.effective_price = pricing.get_effective_prices([product])[product.id]
+        return product.effective_price
 
     def calculate_tax(self, product: Product):
-        return product.unit_price * Decimal(1.1)
+        return pricing.get_price_with_tax(self.get_effective_price(product))
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # The annotation was computed from the old unit price.
+        instance.__dict__.pop('effective_price', None)
+        return instance
+
+    def get_tags(self, product: Product):
+        # Callers may set these from TaggedItem.objects.get_tags_for_many().
+        tags = getattr(product, 'tags', None)
+        if tags is None:
+            tags = [tagged_item.tag for tagged_item in TaggedItem.objects.get_tags_for(Product, product.id)]
+        return [{'id': tag.id, 'label': tag.label} for tag in tags]
     
 
+class ProductValuesSerializer:
+    # Read-only twin of ProductSerializer for list pages. It works on the
+    # .values() rows built by ProductViewSet.paginate_queryset and skips
+    # DRF's per-field machinery; its output must stay identical.
+    sources = {
+        'collection': ['collection_id'],
+        'price_with_tax': ['effective_price'],
+        'tags': [],
+    }
+
+    def __init__(self, rows, many=True, context=None):
+        self.rows = rows
+        self.context = context or {}
+        request = self.context.get('request')
+        selected = ProductSerializer.get_selected_fields(request)
+        self.fields = ProductSerializer.Meta.fields if selected is None else selected
+
+        # Reversing once and splicing the pk in per row is much cheaper
+        # than a reverse() for every product.
+        path = reverse('collection-detail', kwargs={'pk': PK_PLACEHOLDER})
+        url = request.build_absolute_uri(path) if request is not None else path
+        self.collection_url_prefix, self.collection_url_suffix = url.rsplit(PK_PLACEHOLDER, 1)
+
+        getters = {
+            'id': itemgetter('id'),
+            'title': itemgetter('title'),
+            'slug': itemgetter('slug'),
+            'description': itemgetter('description'),
+            'unit_price': lambda row: row['unit_price'].quantize(pricing.CENT),
+            'effective_price': itemgetter('effective_price'),
+            'inventory': itemgetter('inventory'),
+            'price_with_tax': lambda row: pricing.get_price_with_tax(row['effective_price']),
+            'collection': lambda row: f"{self.collection_url_prefix}{row['collection_id']}{self.collection_url_suffix}",
+            'tags': lambda row: [{'id': tag.id, 'label': tag.label} for tag in row['tags']],
+            'review_count': itemgetter('review_count'),
+            'last_review_date': lambda row: row['last_review_date'] and row['last_review_date'].isoformat(),
+        }
+        self.getters = [(field_name, getters[field_name]) for field_name in self.fields]
+
+    @classmethod
+    def get_value_fields(cls, field_names):
+        value_fields = ['id']
+        for field_name in field_names:
+            value_fields += cls.sources.get(field_name, [field_name])
+        return value_fields
+
+    @property
+    def data(self):
+        return [{field_name: getter(row) for field_name, getter in self.getters} for row in self.rows]
+
+
 class SimpleProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ['id', 'title', 'unit_price']
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class BulkProductUpdateItemSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(min_value=1)
+    collection = serializers.IntegerField(min_value=1, required=False)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'title', 'slug', 'description', 'unit_price', 'inventory', 'collection']
+
+    def validate(self, attrs):
+        # Items are validated with partial=True, which doesn't enforce
+        # required fields, but every item still needs its id.
+        if 'id' not in attrs:
+            raise serializers.ValidationError({'id': [self.fields['id'].error_messages['required']]})
+        return attrs
+
+
+class BulkProductUpdateSerializer(serializers.Serializer):
+    MAX_PRODUCTS = 5000
+    BATCH_SIZE = 500
+
+    products = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=MAX_PRODUCTS)
+
+    def validate_products(self, products):
+        # Items are validated one by one so a bad item fails alone; the
+        # products and collections they refer to are looked up in one query each.
+        child = BulkProductUpdateItemSerializer(partial=True)
+        self.results = [None] * len(products)
+        updates = {}
+        for index, item in enumerate(products):
+            try:
+                data = child.run_validation(item)
+            except serializers.ValidationError as error:
+                self.results[index] = {'id': item.get('id'), 'status': 'invalid', 'errors': error.detail}
+                continue
+            if data['id'] in updates:
+                self.results[index] = {'id': data['id'], 'status': 'invalid', 'errors': ['The product is listed more than once.']}
+                continue
+            updates[data['id']] = (index, data)
+
+        found_ids = set(Product.objects.filter(pk__in=updates).values_list('id', flat=True))
+        collection_ids = {data['collection'] for _, data in updates.values() if 'collection' in data}
+        found_collection_ids = set(Collection.objects.filter(pk__in=collection_ids).values_list('id', flat=True))
+
+        for product_id, (index, data) in list(updates.items()):
+            if product_id not in found_ids:
+                self.results[index] = {'id': product_id, 'status': 'not_found'}
+                del updates[product_id]
+            elif 'collection' in data and data['collection'] not in found_collection_ids:
+                self.results[index] = {'id': product_id, 'status': 'invalid', 'errors': {'collection': ['No collection with the given ID was found!']}}
+                del updates[product_id]
+
+        self.updates = updates
+        return products
+
+    def save(self, **kwargs):
+        # bulk_update() needs one field list per statement, so items are
+        # grouped by the fields they change.
+        now = timezone.now()
+        groups = {}
+        for product_id, (index, data) in self.updates.items():
+            fields = tuple(sorted(field for field in data if field != 'id'))
+            product = Product(pk=product_id, last_update=now)
+            for field in fields:
+                setattr(product, 'collection_id' if field == 'collection' else field, data[field])
+            groups.setdefault(fields, []).append(product)
+            self.results[index] = {'id': product_id, 'status': 'updated'}
+
+        with transaction.atomic():
+            for fields, products in groups.items():
+                Product.objects.bulk_update(products, [*fields, 'last_update'], batch_size=self.BATCH_SIZE)
+        return self.results
+
+
+class BulkProductDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=BulkProductUpdateSerializer.MAX_PRODUCTS)
+
+    def save(self, **kwargs):
+        ids = list(dict.fromkeys(self.validated_data['ids']))
+        found_ids = set(Product.objects.filter(pk__in=ids).values_list('id', flat=True))
+        ordered_ids = set(
+            OrderItem.objects
+            .filter(product_id__in=found_ids)
+            .values_list('product_id', flat=True)
+            .distinct()
+        )
+        deletable_ids = found_ids - ordered_ids
+        # Deleting still goes through the collector, so an order placed in
+        # the meantime raises ProtectedError instead of being orphaned.
+        Product.objects.filter(pk__in=deletable_ids).delete()
+
+        results = []
+        for product_id in ids:
+            if product_id not in found_ids:
+                results.append({'id': product_id, 'status': 'not_found'})
+            elif product_id in ordered_ids:
+                results.append({'id': product_id, 'status': 'protected', 'errors': ["Product cannot be deleted because it's associated with an orderitem."]})
+            else:
+                results.append({'id': product_id, 'status': 'deleted'})
+        return results
+
+
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ['id', 'date', 'name', 'description']
@@ -50,7 +281,10 @@ class CartItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart_item: CartItem):
-        return cart_item.quantity * cart_item.product.unit_price
+        # Precomputed by CartItem.objects.with_total_price() on the read paths.
+        if hasattr(cart_item, 'total_price'):
+            return cart_item.total_price
+        return cart_item.quantity * pricing.get_effective_prices([cart_item.product])[cart_item.product_id]
 
     class Meta:
         model = CartItem
@@ -63,13 +297,24 @@ class CartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart: Cart):
-        return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
+        # Precomputed by Cart.objects.with_totals() on the read paths.
+        if hasattr(cart, 'total_price'):
+            return cart.total_price
+        items = cart.items.all()
+        prices = pricing.get_effective_prices([item.product for item in items])
+        return sum([item.quantity * prices[item.product_id] for item in items])
 
     class Meta:
         model = Cart
         fields = ['id', 'items', 'total_price']
 
 
+class CartSummarySerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    item_count = serializers.IntegerField()
+    total_price = serializers.DecimalField(max_digits=11, decimal_places=2)
+
+
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
@@ -83,13 +328,8 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except CartItem.DoesNotExist:
-            self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
+        CartItem.objects.add_quantities(cart_id, {product_id: quantity})
+        self.instance = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
 
         return self.instance
 
@@ -99,6 +339,39 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product_id', 'quantity']
 
 
+class BatchCartItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=CartItem.MAX_QUANTITY)
+
+
+class BatchAddCartItemSerializer(serializers.Serializer):
+    items = BatchCartItemSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        product_ids = {item['product_id'] for item in items}
+        found_ids = set(Product.objects.filter(pk__in=product_ids).values_list('id', flat=True))
+        missing_ids = sorted(product_ids - found_ids)
+        if missing_ids:
+            raise serializers.ValidationError(
+                f"No products with the IDs:{', '.join(map(str, missing_ids))} were found!")
+        return items
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        quantities = {}
+        for item in self.validated_data['items']:
+            product_id = item['product_id']
+            quantities[product_id] = quantities.get(product_id, 0) + item['quantity']
+
+        # A single upsert statement, so the whole batch applies atomically.
+        CartItem.objects.add_quantities(cart_id, quantities)
+        self.instance = CartItem.objects \
+            .select_related('product') \
+            .filter(cart_id=cart_id, product_id__in=quantities) \
+            .with_total_price()
+        return self.instance
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
@@ -113,6 +386,14 @@ class CustomerSerializer(serializers.ModelSerializer):
         fields = ['id', 'user_id', 'phone', 'birth_date', 'membership']
 
 
+class CustomerStatsSerializer(serializers.ModelSerializer):
+    average_order_value = serializers.DecimalField(max_digits=11, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = CustomerStats
+        fields = ['order_count', 'paid_order_count', 'lifetime_spend', 'average_order_value', 'last_order_at']
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = SimpleProductSerializer()
 
@@ -121,12 +402,17 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'unit_price', 'quantity']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
+    total_price = serializers.SerializerMethodField()
+
+    def get_total_price(self, order: Order):
+        # Items carry the prices charged at checkout, promotions included.
+        return sum([item.quantity * item.unit_price for item in order.items.all()])
 
     class Meta:
         model = Order
-        fields = ['id', 'customer', 'placed_at', 'payment_status', 'items']
+        fields = ['id', 'customer', 'placed_at', 'payment_status', 'items', 'total_price']
 
     
 class UpdateOrderSerializer(serializers.ModelSerializer):
@@ -135,38 +421,105 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
         fields = ['payment_status']
 
 
+class OutOfStockError(Exception):
+    def __init__(self, items):
+        super().__init__('Some products in the cart are out of stock.')
+        self.items = items
+
+
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
+        item_count = Cart.objects \
+            .filter(pk=cart_id) \
+            .annotate(item_count=Count('items')) \
+            .values_list('item_count', flat=True) \
+            .first()
+        if item_count is None:
             raise ValidationError('No cart with the given ID was found!')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
+        if item_count == 0:
             raise ValidationError('The cart is empty!')
         return cart_id
 
     def save(self, **kwargs):
+        cart_id = self.validated_data['cart_id']
+
         with transaction.atomic():
-            customer = Customer.objects.get(user_id=self.context['user_id'])
-            order = Order.objects.create(customer=customer)
-
-            cart_id = self.validated_data['cart_id']
-            cart_items = CartItem.objects \
-                .select_related('product') \
-                .filter(cart_id=cart_id)
-            
+            # Lock the cart first so the same cart can't be checked out twice,
+            # then the products in primary key order so concurrent checkouts
+            # over overlapping products can't deadlock.
+            if not Cart.objects.select_for_update().filter(pk=cart_id).values_list('pk', flat=True):
+                raise serializers.ValidationError({'cart_id': ['No cart with the given ID was found!']})
+
+            quantities = dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+            if not quantities:
+                raise serializers.ValidationError({'cart_id': ['The cart is empty!']})
+
+            products = list(
+                Product.objects
+                .select_for_update()
+                .filter(pk__in=quantities)
+                .order_by('pk')
+                .only('id', 'title', 'unit_price', 'inventory')
+            )
+            out_of_stock = [
+                {
+                    'product_id': product.id,
+                    'title': product.title,
+                    'requested': quantities[product.id],
+                    'available': product.inventory
+                } for product in products if product.inventory < quantities[product.id]
+            ]
+            if out_of_stock:
+                raise OutOfStockError(out_of_stock)
+
+            order = Order.objects.create(customer_id=self.context['customer_id'])
+
+            # Charged prices are read from the database, not the cache.
+            prices = pricing.get_effective_prices(products, cached=False)
             order_items = [
                 OrderItem(
                     order=order,
-                    product=item.product,
-                    quantity=item.quantity,
-                    unit_price=item.product.unit_price
-                ) for item in cart_items
+                    product=product,
+                    quantity=quantities[product.id],
+                    unit_price=prices[product.id]
+                ) for product in products
             ]
             OrderItem.objects.bulk_create(order_items)
+            Product.objects.filter(pk__in=quantities).update(
+                inventory=F('inventory') - Case(
+                    *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()]
+                ),
+                last_update=timezone.now()
+            )
             Cart.objects.filter(pk=cart_id).delete()
 
-            order_created.send_robust(self.__class__, order=order)
+            outbox.enqueue(outbox.ORDER_CREATED, order_id=order.id)
 
             return order
-        
\ No newline at end of file
+
+
+class SalesQuerySerializer(serializers.Serializer):
+    MAX_DAYS = 366
+
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    group_by = serializers.ChoiceField(choices=['day', 'product', 'collection'], default='day')
+    collection = serializers.IntegerField(min_value=1, required=False)
+    product = serializers.IntegerField(min_value=1, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+    def validate(self, data):
+        data['end'] = data.get('end', timezone.localdate())
+        data['start'] = data.get('start', data['end'] - timedelta(days=29))
+        if data['start'] > data['end']:
+            raise serializers.ValidationError('The start date cannot be after the end date!')
+        if (data['end'] - data['start']).days >= self.MAX_DAYS:
+            raise serializers.ValidationError(f'The date range cannot be longer than {self.MAX_DAYS} days!')
+        return data
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+    since = serializers.DateTimeField(required=False)
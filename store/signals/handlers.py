@@ -1,9 +1,241 @@
+from decimal import Decimal
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.db.models import F, Max
 from django.dispatch import receiver
-from store.models import Customer
+from django.utils import timezone
+from store import analytics, pricing
+from store.cache import catalog_cache
+from store.models import Cart, Customer, CustomerStats, Product, Collection, Promotion, Review, Order, OrderItem
+from store.search import get_search_backend
+from tags.models import Tag, TaggedItem
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_customer_for_new_user(sender, **kwargs):
     if kwargs['created']:
         Customer.objects.create(user=kwargs['instance'])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+@receiver(m2m_changed, sender=Product.promotions.through)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def invalidate_catalog_cache(sender, **kwargs):
+    catalog_cache.bump_version()
+
+
+def reprice_products(product_ids):
+    # Promotions feed the effective price, so drop the cached discounts and
+    # move last_update (the products' ETag/Last-Modified validator).
+    pricing.invalidate()
+    Product.objects.filter(pk__in=list(product_ids)).update(last_update=timezone.now())
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def reprice_products_on_promotions_change(sender, **kwargs):
+    action = kwargs['action']
+    instance = kwargs['instance']
+    if action == 'pre_clear' and kwargs['reverse']:
+        instance._cleared_product_ids = list(instance.product_set.values_list('id', flat=True))
+    elif action in ['post_add', 'post_remove']:
+        reprice_products(kwargs['pk_set'] if kwargs['reverse'] else [instance.pk])
+    elif action == 'post_clear':
+        reprice_products(getattr(instance, '_cleared_product_ids', []) if kwargs['reverse'] else [instance.pk])
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(pre_delete, sender=Promotion)
+def reprice_products_of_promotion(sender, **kwargs):
+    if kwargs.get('created'):
+        return
+    reprice_products(kwargs['instance'].product_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def touch_tagged_product(sender, **kwargs):
+    # Tags are part of the product payload, so they move last_update too
+    # (it is the product's ETag/Last-Modified validator).
+    tagged_item = kwargs['instance']
+    if tagged_item.content_type_id == ContentType.objects.get_for_model(Product).id:
+        Product.objects.filter(pk=tagged_item.object_id).update(last_update=timezone.now())
+
+
+@receiver(post_save, sender=Tag)
+def touch_products_of_renamed_tag(sender, **kwargs):
+    if kwargs['created']:
+        return
+    product_ids = TaggedItem.objects \
+        .filter(tag=kwargs['instance'], content_type=ContentType.objects.get_for_model(Product)) \
+        .values('object_id')
+    Product.objects.filter(pk__in=product_ids).update(last_update=timezone.now())
+
+
+@receiver(pre_delete, sender=Product)
+def touch_carts_of_deleted_product(sender, **kwargs):
+    # The product's cart items are cascaded away without touching their carts.
+    Cart.objects.filter(items__product=kwargs['instance']).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, **kwargs):
+    update_fields = kwargs['update_fields']
+    if update_fields and not {'title', 'description'} & set(update_fields):
+        return
+    get_search_backend().index(kwargs['instance'])
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_collection(sender, **kwargs):
+    instance = kwargs['instance']
+    update_fields = kwargs['update_fields']
+    if instance._state.adding or (update_fields and 'collection' not in update_fields):
+        return
+    instance._previous_collection_id = Product.objects \
+        .filter(pk=instance.pk) \
+        .values_list('collection_id', flat=True) \
+        .first()
+
+
+@receiver(post_save, sender=Product)
+def update_collection_product_count(sender, **kwargs):
+    instance = kwargs['instance']
+    if kwargs['created']:
+        Collection.adjust_product_counts({instance.collection_id: 1})
+        return
+
+    previous_collection_id = getattr(instance, '_previous_collection_id', None)
+    if previous_collection_id is not None and previous_collection_id != instance.collection_id:
+        Collection.adjust_product_counts({
+            previous_collection_id: -1,
+            instance.collection_id: 1,
+        })
+    instance._previous_collection_id = instance.collection_id
+
+
+@receiver(post_delete, sender=Product)
+def decrement_collection_product_count(sender, **kwargs):
+    Collection.adjust_product_counts({kwargs['instance'].collection_id: -1})
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_summary(sender, **kwargs):
+    if not kwargs['created']:
+        return
+    review = kwargs['instance']
+    Product.objects \
+        .filter(pk=review.product_id) \
+        .update(review_count=F('review_count') + 1, last_review_date=review.date, last_update=timezone.now())
+    catalog_cache.bump_version()
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_summary(sender, **kwargs):
+    product_id = kwargs['instance'].product_id
+    last_review_date = Review.objects \
+        .filter(product_id=product_id) \
+        .aggregate(last_review_date=Max('date'))['last_review_date']
+    Product.objects \
+        .filter(pk=product_id) \
+        .update(review_count=F('review_count') - 1, last_review_date=last_review_date, last_update=timezone.now())
+    catalog_cache.bump_version()
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_payment_status(sender, **kwargs):
+    instance = kwargs['instance']
+    update_fields = kwargs['update_fields']
+    if instance._state.adding or (update_fields and 'payment_status' not in update_fields):
+        return
+    instance._previous_payment_status = Order.objects \
+        .filter(pk=instance.pk) \
+        .values_list('payment_status', flat=True) \
+        .first()
+
+
+@receiver(post_save, sender=Order)
+def update_customer_stats(sender, **kwargs):
+    order = kwargs['instance']
+    if kwargs['created']:
+        previous_status = None
+    else:
+        previous_status = getattr(order, '_previous_payment_status', order.payment_status)
+    order._previous_payment_status = order.payment_status
+
+    sign = Order.payment_status_sign(previous_status, order.payment_status)
+    if not kwargs['created'] and not sign:
+        return
+    if not kwargs['created']:
+        analytics.adjust_order_sales(order.pk, sign)
+
+    lifetime_spend = 0
+    if sign:
+        lifetime_spend = sign * Order.objects.filter(pk=order.pk).totals().get(order.pk, 0)
+    CustomerStats.objects.adjust(
+        order.customer_id,
+        order_count=1 if kwargs['created'] else 0,
+        paid_order_count=sign,
+        lifetime_spend=lifetime_spend,
+        last_order_at=order.placed_at if kwargs['created'] else None)
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_from_customer_stats(sender, **kwargs):
+    order = kwargs['instance']
+    # Orders with items are protected, so a deleted order has no spend.
+    sign = Order.payment_status_sign(order.payment_status, None)
+    last_order_at = Order.objects \
+        .filter(customer_id=order.customer_id) \
+        .aggregate(last_order_at=Max('placed_at'))['last_order_at']
+    CustomerStats.objects \
+        .filter(customer_id=order.customer_id) \
+        .update(
+            order_count=F('order_count') - 1,
+            paid_order_count=F('paid_order_count') + sign,
+            last_order_at=last_order_at)
+
+
+def adjust_spend_for_item(order_id, quantity, unit_price, sign):
+    # Only lines of completed orders count towards the spend.
+    order = Order.objects.filter(pk=order_id).values('customer_id', 'payment_status').first()
+    if order is not None and order['payment_status'] == Order.PAYMENT_STATUS_COMPLETE:
+        CustomerStats.objects.adjust(
+            order['customer_id'], lifetime_spend=sign * quantity * Decimal(str(unit_price)))
+
+
+# Single item edits (e.g. the order admin's inline) keep the spend in step.
+# Queryset-level OrderItem writes don't; check_customer_stats reports any
+# drift they leave and backfill_customer_stats repairs it.
+@receiver(pre_save, sender=OrderItem)
+def remember_order_item(sender, **kwargs):
+    instance = kwargs['instance']
+    if instance._state.adding:
+        return
+    instance._previous_line = OrderItem.objects \
+        .filter(pk=instance.pk) \
+        .values_list('order_id', 'quantity', 'unit_price') \
+        .first()
+
+
+@receiver(post_save, sender=OrderItem)
+def update_spend_for_saved_item(sender, **kwargs):
+    item = kwargs['instance']
+    previous_line = getattr(item, '_previous_line', None)
+    if previous_line is not None:
+        adjust_spend_for_item(*previous_line, sign=-1)
+    adjust_spend_for_item(item.order_id, item.quantity, item.unit_price, sign=1)
+    item._previous_line = (item.order_id, item.quantity, item.unit_price)
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_spend_for_deleted_item(sender, **kwargs):
+    item = kwargs['instance']
+    adjust_spend_for_item(item.order_id, item.quantity, item.unit_price, sign=-1)
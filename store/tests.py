@@ -1,3 +1,1514 @@
-from django.test import TestCase
+import os
+import queue
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from base64 import b64encode
+from contextlib import ExitStack
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib import parse
+from django.db import connection, connections
+from django.db.models import Q
+from django.contrib.auth.models import Group, Permission
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+from core.authentication import CachedJWTAuthentication
+from core.models import User
+from tags.models import Tag, TaggedItem
+from store import export, outbox, pricing
+from store.cache import CatalogCache, catalog_cache
+from store.models import Cart, CartItem, Collection, Customer, CustomerStats, Order, OrderItem, OutboxMessage, Product, ProductSearchTerm, Promotion, Review, SalesRollupCheckpoint
+from store.search import InvertedIndexBackend
+from store.serializers import BulkProductUpdateSerializer, ProductSerializer, ProductValuesSerializer
+from store.views import CustomerViewSet, ExportViewSet
 
-# Create your tests here.
+# Benchmarks are skipped by default; run them with
+#   BENCHMARK=1 python manage.py test --tag=benchmark
+BENCHMARK = bool(os.environ.get('BENCHMARK'))
+
+
+def benchmark(test_case):
+    return tag('benchmark')(skipUnless(BENCHMARK, 'set BENCHMARK=1 to run benchmarks')(test_case))
+
+
+def create_products(collection, count, **kwargs):
+    defaults = {'slug': 'product', 'unit_price': Decimal(10), 'inventory': 10}
+    products = [
+        Product(title=f'Product {i:07}', collection=collection, **{**defaults, **kwargs})
+        for i in range(count)
+    ]
+    return Product.objects.bulk_create(products, batch_size=5000)
+
+
+def timed(func, repeat=20):
+    # Median wall time of func() in milliseconds.
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def encode_cursor(position, reverse=False):
+    tokens = {'p': [str(value) for value in position]}
+    if reverse:
+        tokens['r'] = '1'
+    return b64encode(parse.urlencode(tokens, doseq=True).encode('ascii')).decode('ascii')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        # Repeated titles and prices, so pages have to break ties on id.
+        for i in range(35):
+            Product.objects.create(
+                title=f'Product {i % 7}', slug='product', unit_price=Decimal(i % 5 + 1),
+                inventory=10, collection=collection)
+        user = User.objects.create(username='user', email='user@domain.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def walk(self, url, link='next'):
+        ids = []
+        urls = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            urls.append(url)
+            results = [row['id'] for row in response.data['results']]
+            ids = ids + results if link == 'next' else results + ids
+            url = response.data[link]
+        return ids, urls
+
+    def test_pages_follow_the_ordering(self):
+        orderings = {
+            '': ('title', 'id'),
+            'unit_price': ('unit_price', 'id'),
+            '-unit_price': ('-unit_price', '-id'),
+            'last_update': ('last_update', 'id'),
+            '-last_update': ('-last_update', '-id'),
+        }
+        for ordering, order_by in orderings.items():
+            with self.subTest(ordering=ordering):
+                ids, _ = self.walk(f'/store/products/?ordering={ordering}')
+                expected = list(Product.objects.order_by(*order_by).values_list('id', flat=True))
+                self.assertEqual(ids, expected)
+
+    def test_previous_links_walk_back_to_the_first_page(self):
+        ids, urls = self.walk('/store/products/?ordering=-unit_price')
+        last_page = self.client.get(urls[-1])
+        back, _ = self.walk(last_page.data['previous'], link='previous')
+        self.assertEqual(back, ids[:len(back)])
+        self.assertEqual(len(back), 30)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/store/products/?cursor=invalid').status_code, 404)
+        cursor = encode_cursor(['Product 1'])
+        self.assertEqual(self.client.get(f'/store/products/?cursor={cursor}').status_code, 404)
+
+    def test_tampered_cursor(self):
+        positions = {
+            '/store/products/': [['Product 1', 'abc'], ['Product 1', '1.5'], ['Product 1', '9' * 30]],
+            '/store/products/?ordering=unit_price': [['abc', '1'], ['NaN', '1'], ['1e400', '1']],
+            '/store/products/?ordering=effective_price': [['abc', '1']],
+            '/store/products/?ordering=last_update': [['yesterday', '1'], ['2026-13-45 00:00', '1']],
+            '/store/products/?search=product': [['high', '1']],
+            '/store/orders/': [['abc', '1']],
+        }
+        for url, cursors in positions.items():
+            for position in cursors:
+                with self.subTest(url=url, position=position):
+                    separator = '&' if '?' in url else '?'
+                    response = self.client.get(f'{url}{separator}cursor={encode_cursor(position)}')
+                    self.assertEqual(response.status_code, 404)
+
+        # Positions from real links still round-trip.
+        response = self.client.get('/store/products/?ordering=last_update')
+        self.assertEqual(self.client.get(response.data['next']).status_code, 200)
+
+    def test_orders_are_paged_newest_first(self):
+        customer = Customer.objects.get(user__username='user')
+        Order.objects.bulk_create([Order(customer=customer) for _ in range(25)])
+        ids, urls = self.walk('/store/orders/')
+        self.assertEqual(ids, list(Order.objects.order_by('-placed_at', '-id').values_list('id', flat=True)))
+        self.assertEqual(len(urls), 3)
+
+    def test_reviews_are_paged_newest_first(self):
+        product = Product.objects.first()
+        reviews = Review.objects.bulk_create([
+            Review(product=product, name='Name', description='Review') for _ in range(25)])
+        # Several reviews share a date, so pages have to break ties on id.
+        today = timezone.localdate()
+        for i, review in enumerate(reviews):
+            Review.objects.filter(pk=review.pk).update(date=today - timedelta(days=i % 4))
+        ids, urls = self.walk(f'/store/products/{product.id}/reviews/')
+        self.assertEqual(ids, list(Review.objects.order_by('-date', '-id').values_list('id', flat=True)))
+        self.assertEqual(len(urls), 3)
+
+
+class OrderQueryCountTests(TestCase):
+    # The read path has a fixed query budget: the customer id, the orders,
+    # their items and the items' products.
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = create_products(collection, 10)
+        user = User.objects.create(username='user', email='user@domain.com')
+        self.customer = Customer.objects.get(user=user)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def create_orders(self, count, items=3):
+        orders = Order.objects.bulk_create([Order(customer=self.customer) for _ in range(count)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, unit_price=product.unit_price)
+            for order in orders
+            for product in self.products[:items]
+        ])
+        return orders
+
+    def test_list(self):
+        for count in [2, 10]:
+            with self.subTest(orders=count):
+                OrderItem.objects.all().delete()
+                Order.objects.all().delete()
+                self.create_orders(count)
+                with self.assertNumQueries(4):
+                    response = self.client.get('/store/orders/')
+                self.assertEqual(len(response.data['results']), count)
+
+    def test_retrieve(self):
+        for items in [2, 10]:
+            with self.subTest(items=items):
+                order, = self.create_orders(1, items=items)
+                with self.assertNumQueries(4):
+                    response = self.client.get(f'/store/orders/{order.id}/')
+                self.assertEqual(len(response.data['items']), items)
+
+    def test_create(self):
+        for items in [2, 10]:
+            with self.subTest(items=items):
+                cart = Cart.objects.create()
+                CartItem.objects.bulk_create([
+                    CartItem(cart=cart, product=product, quantity=1)
+                    for product in self.products[:items]
+                ])
+                # Checkout itself (locks, stock, stats, outbox) plus the
+                # re-read of the new order.
+                with self.assertNumQueries(20):
+                    response = self.client.post('/store/orders/', {'cart_id': str(cart.id)})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['items']), items)
+
+
+class CollectionProductCountTests(TestCase):
+    def setUp(self):
+        self.first = Collection.objects.create(title='First')
+        self.second = Collection.objects.create(title='Second')
+
+    def assertCounts(self, first, second):
+        counts = dict(Collection.objects.values_list('id', 'product_count'))
+        self.assertEqual((counts[self.first.id], counts[self.second.id]), (first, second))
+
+    def test_create_and_delete(self):
+        product = Product.objects.create(
+            title='Product', slug='product', unit_price=Decimal(10), inventory=10, collection=self.first)
+        self.assertCounts(1, 0)
+        product.delete()
+        self.assertCounts(0, 0)
+
+    def test_save_moves_the_product(self):
+        product, = create_products(self.first, 1)
+        product.collection = self.second
+        product.save()
+        self.assertCounts(0, 1)
+        # Saving again without a move changes nothing.
+        product.title = 'Renamed'
+        product.save()
+        self.assertCounts(0, 1)
+        product.save(update_fields=['title'])
+        self.assertCounts(0, 1)
+
+    def test_bulk_create(self):
+        create_products(self.first, 3)
+        create_products(self.second, 2)
+        self.assertCounts(3, 2)
+
+    def test_update(self):
+        create_products(self.first, 3)
+        create_products(self.second, 2)
+        Product.objects.filter(collection=self.first).update(collection=self.second)
+        self.assertCounts(0, 5)
+        Product.objects.all().update(collection_id=self.first.id)
+        self.assertCounts(5, 0)
+        Product.objects.all().update(inventory=1)
+        self.assertCounts(5, 0)
+
+    def test_bulk_update(self):
+        products = create_products(self.first, 4)
+        for product in products[:3]:
+            product.collection = self.second
+        Product.objects.bulk_update(products, ['collection'])
+        self.assertCounts(1, 3)
+        Product.objects.bulk_update(products, ['collection', 'title'])
+        self.assertCounts(1, 3)
+
+    def test_serializer_reads_the_column(self):
+        create_products(self.first, 2)
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(f'/store/collections/{self.first.id}/')
+        self.assertEqual(response.data['product_count'], 2)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+
+
+class CartItemUpsertTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = create_products(collection, 3)
+        self.cart = Cart.objects.create()
+        self.url = f'/store/carts/{self.cart.id}/items/'
+        self.client = APIClient()
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity'))
+
+    def test_add_inserts_then_increments(self):
+        product = self.products[0]
+        for _ in range(2):
+            response = self.client.post(self.url, {'product_id': product.id, 'quantity': 2})
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], 4)
+        self.assertEqual(self.quantities(), {product.id: 4})
+
+    def test_batch_add(self):
+        first, second, _ = self.products
+        CartItem.objects.create(cart=self.cart, product=first, quantity=1)
+        items = [
+            {'product_id': first.id, 'quantity': 2},
+            {'product_id': second.id, 'quantity': 3},
+            {'product_id': second.id, 'quantity': 1},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url + 'batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.quantities(), {first.id: 3, second.id: 4})
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 1)
+
+    def test_batch_add_validates_products_in_one_query(self):
+        items = [{'product_id': product.id, 'quantity': 1} for product in self.products]
+        items.append({'product_id': 0, 'quantity': 1})
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url + 'batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantities(), {})
+
+    def test_quantity_is_capped(self):
+        product = self.products[0]
+        items = [{'product_id': product.id, 'quantity': CartItem.MAX_QUANTITY}] * 2
+        for _ in range(2):
+            response = self.client.post(self.url + 'batch/', {'items': items}, format='json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.quantities(), {product.id: CartItem.MAX_QUANTITY})
+        response = self.client.post(self.url, {'product_id': product.id, 'quantity': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], CartItem.MAX_QUANTITY)
+
+
+class CheckoutInventoryTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = create_products(collection, 2, inventory=3)
+        user = User.objects.create(username='user', email='user@domain.com')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def checkout(self, quantities):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=quantity)
+            for product, quantity in zip(self.products, quantities)
+        ])
+        return self.client.post('/store/orders/', {'cart_id': str(cart.id)})
+
+    def inventory(self):
+        return list(Product.objects.order_by('id').values_list('inventory', flat=True))
+
+    def test_checkout_decrements_inventory(self):
+        self.assertEqual(self.checkout([2, 3]).status_code, 200)
+        self.assertEqual(self.inventory(), [1, 0])
+
+    def test_out_of_stock_items_are_reported(self):
+        response = self.checkout([2, 4])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['items'], [{
+            'product_id': self.products[1].id,
+            'title': self.products[1].title,
+            'requested': 4,
+            'available': 3,
+        }])
+        self.assertEqual(self.inventory(), [3, 3])
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_checkout_invalidates_cached_products(self):
+        anonymous = APIClient()
+        self.assertEqual([row['inventory'] for row in anonymous.get('/store/products/').data['results']], [3, 3])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.checkout([3, 1]).status_code, 200)
+        self.assertEqual([row['inventory'] for row in anonymous.get('/store/products/').data['results']], [0, 2])
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = create_products(collection, 2, unit_price=Decimal('2.50'))
+        self.client = APIClient()
+
+    def summary(self, cart_id):
+        return self.client.get(f'/store/carts/{cart_id}/summary/')
+
+    def test_totals_are_aggregated_in_the_database(self):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=quantity)
+            for product, quantity in zip(self.products, [2, 3])
+        ])
+        with self.assertNumQueries(1):
+            response = self.summary(cart.id)
+        self.assertEqual(response.data, {'id': str(cart.id), 'item_count': 5, 'total_price': Decimal('12.50')})
+        self.assertEqual(response.data['total_price'], self.client.get(f'/store/carts/{cart.id}/').data['total_price'])
+
+    def test_empty_cart(self):
+        cart = Cart.objects.create()
+        self.assertEqual(self.summary(cart.id).data, {'id': str(cart.id), 'item_count': 0, 'total_price': Decimal('0.00')})
+        cart = Cart.objects.with_totals().get(pk=cart.id)
+        self.assertEqual((cart.item_count, cart.total_price), (0, 0))
+
+    def test_unknown_carts(self):
+        for cart_id in ['abc', '00000000-0000-0000-0000-000000000000']:
+            with self.subTest(cart_id=cart_id):
+                self.assertEqual(self.summary(cart_id).status_code, 404)
+                self.assertEqual(self.client.get(f'/store/carts/{cart_id}/').status_code, 404)
+
+
+class PurgeCartsTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.product, = create_products(collection, 1)
+
+    def create_carts(self, count, days_idle, items=0):
+        carts = Cart.objects.bulk_create([Cart() for _ in range(count)])
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=self.product, quantity=1) for cart in carts[:items]])
+        Cart.objects \
+            .filter(pk__in=[cart.pk for cart in carts]) \
+            .update(updated_at=timezone.now() - timedelta(days=days_idle))
+        return {cart.pk for cart in carts}
+
+    def purge(self, *args):
+        output = StringIO()
+        call_command('purge_carts', *args, stdout=output)
+        return output.getvalue()
+
+    def remaining(self):
+        return set(Cart.objects.values_list('pk', flat=True))
+
+    def test_carts_idle_past_the_ttl_are_purged(self):
+        self.create_carts(2, days_idle=31)
+        idle = self.create_carts(2, days_idle=20)
+        active = self.create_carts(1, days_idle=0)
+        self.assertIn('2 carts were purged', self.purge())
+        self.assertEqual(self.remaining(), idle | active)
+        self.assertIn('2 carts were purged', self.purge('--ttl-days', '10'))
+        self.assertEqual(self.remaining(), active)
+
+    def test_dry_run_deletes_nothing(self):
+        carts = self.create_carts(3, days_idle=31, items=3)
+        self.assertIn('3 carts would be purged', self.purge('--dry-run'))
+        self.assertEqual(self.remaining(), carts)
+        self.assertEqual(CartItem.objects.count(), 3)
+
+    def test_carts_are_deleted_in_batches(self):
+        self.create_carts(5, days_idle=31)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIn('5 carts were purged', self.purge('--batch-size', '2'))
+        cart_deletes = [
+            query for query in queries
+            if query['sql'].startswith('DELETE') and Cart._meta.db_table in query['sql'].replace(CartItem._meta.db_table, '')
+        ]
+        self.assertEqual(len(cart_deletes), 3)
+        self.assertEqual(self.remaining(), set())
+
+    def test_items_are_cascaded(self):
+        self.create_carts(2, days_idle=31, items=2)
+        active = self.create_carts(1, days_idle=0, items=1)
+        self.purge()
+        self.assertEqual(set(CartItem.objects.values_list('cart_id', flat=True)), active)
+        self.assertTrue(Product.objects.filter(pk=self.product.pk).exists())
+
+
+class CustomerStatsTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = create_products(collection, 2, unit_price=Decimal('2.50'))
+        self.user = User.objects.create(username='user', email='user@domain.com')
+        self.customer = Customer.objects.get(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', email='admin@domain.com', is_staff=True))
+
+    def checkout(self):
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=2) for product in self.products])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/store/orders/', {'cart_id': str(cart.id)})
+        self.assertEqual(response.status_code, 200)
+        return Order.objects.get(pk=response.data['id'])
+
+    def assertStats(self, order_count, paid_order_count, lifetime_spend):
+        stats = CustomerStats.objects.get(customer=self.customer)
+        self.assertEqual(
+            (stats.order_count, stats.paid_order_count, stats.lifetime_spend),
+            (order_count, paid_order_count, Decimal(lifetime_spend)))
+        expected = CustomerStats.objects.compute([self.customer.id])[self.customer.id]
+        self.assertFalse(stats.differs_from(expected))
+
+    def test_orders_and_payments(self):
+        order = self.checkout()
+        self.assertStats(1, 0, 0)
+        self.assertEqual(CustomerStats.objects.get(customer=self.customer).last_order_at, order.placed_at)
+
+        url = f'/store/orders/{order.id}/'
+        self.assertEqual(self.client.patch(url, {'payment_status': Order.PAYMENT_STATUS_COMPLETE}).status_code, 200)
+        self.assertStats(1, 1, 10)
+        self.client.patch(url, {'payment_status': Order.PAYMENT_STATUS_COMPLETE})
+        self.assertStats(1, 1, 10)
+        self.client.patch(url, {'payment_status': Order.PAYMENT_STATUS_FAILED})
+        self.assertStats(1, 0, 0)
+
+    def test_bulk_status_changes(self):
+        first, second = self.checkout(), self.checkout()
+        Order.objects.update(payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        self.assertStats(2, 2, 20)
+        Order.objects.filter(pk=first.pk).update(payment_status=Order.PAYMENT_STATUS_PENDING)
+        self.assertStats(2, 1, 10)
+
+    def test_deleted_orders(self):
+        order = self.checkout()
+        empty = Order.objects.create(customer=self.customer, payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        self.assertStats(2, 1, 0)
+        self.assertEqual(self.client.delete(f'/store/orders/{empty.id}/').status_code, 204)
+        self.assertStats(1, 0, 0)
+        self.assertEqual(CustomerStats.objects.get(customer=self.customer).last_order_at, order.placed_at)
+
+    def test_item_edits_on_completed_orders(self):
+        order = self.checkout()
+        Order.objects.update(payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        first, second = order.items.order_by('id')
+        first.quantity = 4
+        first.save()
+        self.assertStats(1, 1, 15)
+        second.delete()
+        self.assertStats(1, 1, 10)
+        OrderItem.objects.create(order=order, product=self.products[1], quantity=1, unit_price=Decimal('1.25'))
+        self.assertStats(1, 1, '11.25')
+
+    def test_backfill_and_check(self):
+        self.checkout()
+        Order.objects.update(payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        other = Customer.objects.get(user__username='admin')
+        CustomerStats.objects.filter(customer=self.customer).update(order_count=5, lifetime_spend=0)
+
+        output = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_customer_stats', stdout=output)
+        self.assertIn(f'Customer {self.customer.id}: orders 5/1', output.getvalue())
+        self.assertNotIn(f'Customer {other.id}:', output.getvalue())
+
+        for _ in range(2):
+            call_command('backfill_customer_stats', batch_size=1, stdout=StringIO())
+            self.assertStats(1, 1, 10)
+            self.assertEqual(CustomerStats.objects.count(), Customer.objects.count())
+        call_command('check_customer_stats', stdout=StringIO())
+
+
+@benchmark
+class CheckoutStressTest(TransactionTestCase):
+    # Fires concurrent checkouts at a few hot products and checks nothing
+    # is oversold. Meant for MySQL; on SQLite it needs a file-backed test
+    # database and OPTIONS['transaction_mode'] = 'IMMEDIATE', and then
+    # only measures serialized writers.
+    checkouts = int(os.environ.get('BENCHMARK_CHECKOUTS', 200))
+    threads = int(os.environ.get('BENCHMARK_THREADS', 16))
+
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        # Every cart wants one of each hot product; there is stock for
+        # roughly half of them.
+        self.stock = self.checkouts // 2
+        self.products = create_products(collection, 3, inventory=self.stock)
+        users = User.objects.bulk_create([
+            User(username=f'user{i}', email=f'user{i}@domain.com') for i in range(self.checkouts)
+        ])
+        Customer.objects.bulk_create([Customer(user=user) for user in users])
+        carts = Cart.objects.bulk_create([Cart() for _ in range(self.checkouts)])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=1)
+            for cart in carts
+            for product in self.products
+        ])
+        self.jobs = list(zip(users, carts))
+
+    def test_concurrent_checkouts(self):
+        jobs = queue.Queue()
+        for job in self.jobs:
+            jobs.put(job)
+        results = []
+        barrier = threading.Barrier(self.threads)
+
+        def worker():
+            client = APIClient()
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        user, cart = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    client.force_authenticate(user)
+                    started = time.perf_counter()
+                    response = client.post('/store/orders/', {'cart_id': str(cart.id)})
+                    results.append((response.status_code, time.perf_counter() - started))
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        statuses = [status_code for status_code, _ in results]
+        latencies = sorted(latency * 1000 for _, latency in results)
+        placed = statuses.count(200)
+        sold = OrderItem.objects.filter(product__in=self.products).values_list('product_id', 'quantity')
+        inventory = dict(Product.objects.filter(pk__in=[product.id for product in self.products]).values_list('id', 'inventory'))
+        print(f'\n{len(results)} checkouts on {self.threads} threads over {connection.vendor}')
+        print(f'  throughput: {len(results) / elapsed:.1f} checkouts/s')
+        print(f'  latency: p50 {statistics.median(latencies):.1f} ms, p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f} ms')
+        print(f'  placed: {placed}, out of stock: {statuses.count(409)}, other: {len(statuses) - placed - statuses.count(409)}')
+
+        self.assertEqual(len(results), self.checkouts)
+        self.assertEqual(placed + statuses.count(409), self.checkouts)
+        self.assertEqual(placed, self.stock)
+        for product in self.products:
+            sold_quantity = sum(quantity for product_id, quantity in sold if product_id == product.id)
+            self.assertEqual(sold_quantity, self.stock)
+            self.assertEqual(inventory[product.id], 0)
+
+
+class ReviewSummaryTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.product, = create_products(collection, 1)
+        self.client = APIClient()
+
+    def summary(self):
+        response = self.client.get(f'/store/products/{self.product.id}/')
+        return response.data['review_count'], response.data['last_review_date']
+
+    def post_review(self):
+        response = self.client.post(
+            f'/store/products/{self.product.id}/reviews/', {'name': 'Name', 'description': 'Review'})
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_summary_follows_created_and_deleted_reviews(self):
+        today = timezone.localdate()
+        earlier = today - timedelta(days=3)
+        self.assertEqual(self.summary(), (0, None))
+
+        first = self.post_review()
+        second = self.post_review()
+        self.assertEqual(self.summary(), (2, today.isoformat()))
+
+        Review.objects.filter(pk=first).update(date=earlier)
+        self.assertEqual(self.client.delete(f'/store/products/{self.product.id}/reviews/{second}/').status_code, 204)
+        self.assertEqual(self.summary(), (1, earlier.isoformat()))
+
+        Review.objects.get(pk=first).delete()
+        self.assertEqual(self.summary(), (0, None))
+
+    def test_reviews_are_indexed_by_product_and_date(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Review._meta.db_table)
+        self.assertIn(['product_id', 'date'], [
+            constraint['columns'] for constraint in constraints.values() if constraint['index']])
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='user', email='user@domain.com')
+        self.order = Order.objects.create(customer=Customer.objects.get(user=user))
+
+    def test_messages_are_delivered_once(self):
+        outbox.enqueue(outbox.ORDER_CREATED, order_id=self.order.id)
+        self.assertEqual(outbox.get_metrics()['depth'], 1)
+        self.assertEqual(outbox.process_batch(), (1, 0))
+        self.assertEqual(outbox.process_batch(), (0, 0))
+        self.assertEqual(outbox.get_metrics(), {'depth': 0, 'lag': 0, 'dead': 0})
+
+    def test_failures_back_off_until_dead(self):
+        message = outbox.enqueue(outbox.ORDER_CREATED, order_id=0)
+        self.assertEqual(outbox.process_batch(max_attempts=2), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('DoesNotExist', message.last_error)
+        # Still backing off.
+        self.assertEqual(outbox.process_batch(max_attempts=2), (0, 0))
+
+        OutboxMessage.objects.filter(pk=message.pk).update(available_at=message.created_at)
+        self.assertEqual(outbox.process_batch(max_attempts=2), (0, 1))
+        metrics = outbox.get_metrics(max_attempts=2)
+        self.assertEqual(metrics, {'depth': 0, 'lag': 0, 'dead': 1})
+
+
+class SalesAnalyticsTests(TestCase):
+    def setUp(self):
+        self.first = Collection.objects.create(title='First')
+        self.second = Collection.objects.create(title='Second')
+        self.shirt, = create_products(self.first, 1, unit_price=Decimal(3))
+        self.hat, = create_products(self.second, 1, unit_price=Decimal(4))
+        user = User.objects.create(username='admin', email='admin@domain.com', is_staff=True)
+        customer = Customer.objects.get(user=user)
+        for _ in range(5):
+            self.create_order(customer, Order.PAYMENT_STATUS_COMPLETE)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def create_order(self, customer, payment_status):
+        order = Order.objects.create(customer=customer, payment_status=payment_status)
+        OrderItem.objects.create(order=order, product=self.shirt, quantity=2, unit_price=3)
+        OrderItem.objects.create(order=order, product=self.hat, quantity=1, unit_price=4)
+        Order.objects.filter(pk=order.pk).update(placed_at=timezone.now() - timedelta(days=1))
+        return Order.objects.get(pk=order.pk)
+
+    def rollup(self):
+        call_command('rollup_sales', '--batch-size', '2', stdout=StringIO())
+
+    def sales(self, **params):
+        response = self.client.get('/store/analytics/sales/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_rollup_is_incremental_and_idempotent(self):
+        self.rollup()
+        self.rollup()
+        self.assertEqual(self.sales()['revenue'], Decimal('50.00'))
+        order = Order.objects.first()
+        OrderItem.objects.create(order=Order.objects.create(customer=order.customer), product=self.hat, quantity=1, unit_price=4)
+        # Too recent to be settled yet.
+        self.rollup()
+        self.assertEqual(self.sales()['revenue'], Decimal('50.00'))
+
+    def test_grouping(self):
+        self.rollup()
+        self.assertEqual(
+            [(row['product_id'], row['units'], row['revenue']) for row in self.sales(group_by='product')['results']],
+            [(self.shirt.id, 10, Decimal('30.00')), (self.hat.id, 5, Decimal('20.00'))])
+        self.assertEqual(
+            [(row['collection_id'], row['revenue']) for row in self.sales(group_by='collection')['results']],
+            [(self.first.id, Decimal('30.00')), (self.second.id, Decimal('20.00'))])
+        data = self.sales(group_by='collection', product=self.hat.id)
+        self.assertEqual(
+            [(row['collection_id'], row['units'], row['revenue']) for row in data['results']],
+            [(self.second.id, 5, Decimal('20.00'))])
+        data = self.sales(group_by='product', collection=self.first.id)
+        self.assertEqual([row['product_id'] for row in data['results']], [self.shirt.id])
+
+    def test_only_completed_orders_count(self):
+        customer = Order.objects.first().customer
+        pending = self.create_order(customer, Order.PAYMENT_STATUS_PENDING)
+        failed = self.create_order(customer, Order.PAYMENT_STATUS_FAILED)
+        self.rollup()
+        self.assertEqual(self.sales()['revenue'], Decimal('50.00'))
+        self.assertEqual(SalesRollupCheckpoint.objects.get().last_order_id, failed.id)
+
+        # Payment changes on orders already rolled up are applied as they happen.
+        pending.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        pending.save()
+        self.assertEqual(self.sales()['revenue'], Decimal('60.00'))
+        self.assertEqual(self.sales(group_by='product')['results'][0]['units'], 12)
+
+        paid = Order.objects.filter(payment_status=Order.PAYMENT_STATUS_COMPLETE).first()
+        paid.payment_status = Order.PAYMENT_STATUS_FAILED
+        paid.save()
+        self.assertEqual(self.sales()['revenue'], Decimal('50.00'))
+        self.rollup()
+        self.assertEqual(self.sales()['revenue'], Decimal('50.00'))
+
+    def test_payments_before_the_rollup_are_counted_once(self):
+        order = self.create_order(Order.objects.first().customer, Order.PAYMENT_STATUS_PENDING)
+        order.payment_status = Order.PAYMENT_STATUS_COMPLETE
+        order.save()
+        self.rollup()
+        self.assertEqual(self.sales()['revenue'], Decimal('60.00'))
+
+    def test_invalid_ranges(self):
+        for params in [{'start': '2020-01-02', 'end': '2020-01-01'}, {'start': '2020-01-01', 'end': '2022-01-01'}]:
+            self.assertEqual(self.client.get('/store/analytics/sales/', params).status_code, 400)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = create_products(collection, 5)
+        user = User.objects.create(username='admin', email='admin@domain.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_accept_headers_do_not_block_the_stream(self):
+        for output, accept in [('ndjson', 'application/x-ndjson'), ('csv', 'text/csv'), ('csv', '*/*')]:
+            with self.subTest(accept=accept):
+                response = self.client.get('/store/export/products/', {'output': output}, HTTP_ACCEPT=accept)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], ExportViewSet.content_types[output])
+                lines = b''.join(response.streaming_content).decode().splitlines()
+                self.assertEqual(len(lines), len(self.products) + (output == 'csv'))
+
+    def test_errors_are_json(self):
+        response = self.client.get('/store/export/products/', {'output': 'xml'}, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_chunks_cover_every_row_once(self):
+        Product.objects.filter(pk__in=[product.id for product in self.products[:3]]).update(last_update=self.products[0].last_update)
+        rows = list(export.iter_products(chunk_size=2))
+        self.assertEqual(sorted(row['id'] for row in rows), sorted(product.id for product in self.products))
+
+
+class BulkProductTests(TestCase):
+    def setUp(self):
+        self.first = Collection.objects.create(title='First')
+        self.second = Collection.objects.create(title='Second')
+        self.products = create_products(self.first, 3)
+        user = User.objects.create(username='admin', email='admin@domain.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def test_bulk_update_reports_each_item(self):
+        first, second, third = [product.id for product in self.products]
+        products = [
+            {'id': first, 'unit_price': '12.50'},
+            {'id': second, 'title': 'Renamed', 'collection': self.second.id},
+            {'id': second, 'inventory': 1},
+            {'id': third, 'unit_price': 0},
+            {'id': third, 'collection': 0},
+            {'id': 999999, 'inventory': 1},
+            {'inventory': 1},
+        ]
+        response = self.client.patch('/store/products/bulk-update/', {'products': products}, format='json')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(
+            [result['status'] for result in results],
+            ['updated', 'updated', 'invalid', 'invalid', 'invalid', 'not_found', 'invalid'])
+        self.assertEqual(results[-1], {'id': None, 'status': 'invalid', 'errors': {'id': ['This field is required.']}})
+
+        self.assertEqual(Product.objects.get(pk=first).unit_price, Decimal('12.50'))
+        self.assertEqual(Product.objects.get(pk=second).collection_id, self.second.id)
+        self.assertEqual(Product.objects.get(pk=third).unit_price, Decimal(10))
+        self.assertEqual(Collection.objects.get(pk=self.second.id).product_count, 1)
+        self.assertEqual(self.client.get('/store/products/', {'search': 'renamed'}).data['results'][0]['id'], second)
+
+    def test_bulk_delete_skips_ordered_products(self):
+        first, second, _ = [product.id for product in self.products]
+        order = Order.objects.create(customer=Customer.objects.get(user__username='admin'))
+        OrderItem.objects.create(order=order, product_id=first, quantity=1, unit_price=10)
+        response = self.client.post('/store/products/bulk-delete/', {'ids': [first, second, 999999]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], ['protected', 'deleted', 'not_found'])
+        self.assertEqual(Collection.objects.get(pk=self.first.id).product_count, 2)
+
+    def test_bulk_endpoints_are_admin_only(self):
+        self.client.force_authenticate(User.objects.create(username='user', email='user@domain.com'))
+        self.assertEqual(self.client.post('/store/products/bulk-delete/', {'ids': [1]}, format='json').status_code, 403)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Collection')
+        self.product = Product.objects.create(
+            title='Product', slug='product', unit_price=Decimal(10), inventory=10, collection=self.collection)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='user', email='user@domain.com'))
+
+    def assertNotModified(self, url, response, queries=None):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        if queries is not None:
+            self.assertEqual(len(captured), queries)
+
+    def assertModified(self, url, response):
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_product(self):
+        url = f'/store/products/{self.product.id}/'
+        response = self.client.get(url)
+        self.assertNotModified(url, response, queries=1)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        TaggedItem.objects.create(tag=Tag.objects.create(label='Tag'), content_object=self.product)
+        self.assertModified(url, response)
+        response = self.client.get(url)
+        self.client.post(f'{url}reviews/', {'name': 'Name', 'description': 'Description'})
+        self.assertModified(url, response)
+
+    def test_lists_are_validated_without_queries(self):
+        for url in ['/store/products/', '/store/products/?search=product', '/store/collections/']:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertNotModified(url, response, queries=0)
+                Product.objects.create(
+                    title='Product', slug='product', unit_price=Decimal(10), inventory=10, collection=self.collection)
+                self.assertModified(url, response)
+
+    def test_lists_see_bulk_writes(self):
+        writes = {
+            'update': lambda: Product.objects.filter(pk=self.product.pk).update(unit_price=5),
+            'bulk_create': lambda: create_products(self.collection, 1),
+            'bulk_update': lambda: Product.objects.bulk_update([Product(pk=self.product.pk, title='Renamed')], ['title']),
+            'recount_collections': lambda: (
+                Collection.objects.update(product_count=0),
+                call_command('recount_collections', stdout=StringIO()),
+            ),
+            # As another worker would, through its own CatalogCache.
+            'another worker': lambda: CatalogCache().bump_version(),
+        }
+        for label, write in writes.items():
+            for url in ['/store/products/', '/store/collections/']:
+                with self.subTest(write=label, url=url):
+                    response = self.client.get(url)
+                    with self.captureOnCommitCallbacks(execute=True):
+                        write()
+                    self.assertModified(url, response)
+
+    def test_cart(self):
+        cart = Cart.objects.create()
+        url = f'/store/carts/{cart.id}/'
+        self.client.post(f'{url}items/', {'product_id': self.product.id, 'quantity': 1})
+        response = self.client.get(url)
+        self.assertNotModified(url, response, queries=1)
+
+        self.product.unit_price = 5
+        self.product.save()
+        self.assertModified(url, response)
+        response = self.client.get(url)
+        self.client.post(f'{url}items/', {'product_id': self.product.id, 'quantity': 1})
+        self.assertModified(url, response)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.product, = create_products(collection, 1)
+        self.client = APIClient()
+        self.admin = APIClient()
+        self.admin.force_authenticate(User.objects.create(username='admin', email='admin@domain.com', is_staff=True))
+
+    def make_key(self, query):
+        request = Request(APIRequestFactory().get(f'/store/products/?{query}'))
+        return catalog_cache.make_key(request, 'list')
+
+    def stats(self):
+        response = self.admin.get('/store/products/cache-stats/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['hits'], response.data['misses']
+
+    def test_keys_ignore_parameter_order(self):
+        self.assertEqual(self.make_key('ordering=title&tag=1'), self.make_key('tag=1&ordering=title'))
+        self.assertEqual(self.make_key('tag=1&tag=2'), self.make_key('tag=2&tag=1'))
+        self.assertNotEqual(self.make_key('tag=1&tag=2'), self.make_key('tag=1'))
+        self.assertNotEqual(self.make_key('tag=1'), self.make_key('tag=2'))
+
+    def test_anonymous_reads_are_counted_and_served_from_the_cache(self):
+        hits, misses = self.stats()
+        self.client.get('/store/products/?ordering=title&page_size=5')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/store/products/?page_size=5&ordering=title').status_code, 200)
+        self.assertEqual(self.stats(), (hits + 1, misses + 1))
+
+    def test_signed_in_reads_bypass_the_cache(self):
+        hits, misses = self.stats()
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.admin.get('/store/products/').status_code, 200)
+            self.assertTrue(queries)
+        self.assertEqual(self.stats(), (hits, misses))
+
+    def test_writes_invalidate_cached_reads(self):
+        url = f'/store/products/{self.product.id}/'
+        self.assertEqual(self.client.get(url).data['title'], 'Product 0000000')
+        self.assertEqual(self.client.get('/store/products/').data['results'][0]['title'], 'Product 0000000')
+
+        response = self.admin.patch(url, {'title': 'Renamed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url).data['title'], 'Renamed')
+        self.assertEqual(self.client.get('/store/products/').data['results'][0]['title'], 'Renamed')
+
+    def test_stats_are_for_admins(self):
+        self.assertEqual(self.client.get('/store/products/cache-stats/').status_code, 401)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        create_products(collection, 3, description='Description')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='user', email='user@domain.com'))
+
+    def get(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/store/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries]
+
+    def test_fields_prunes_the_payload_and_the_select(self):
+        response, queries = self.get(fields='id,title,price_with_tax')
+        self.assertEqual([set(product) for product in response.data['results']], [{'id', 'title', 'price_with_tax'}] * 3)
+        self.assertFalse(any('description' in sql for sql in queries))
+
+    def test_omit(self):
+        response, queries = self.get(omit='description,tags')
+        product = response.data['results'][0]
+        self.assertNotIn('description', product)
+        self.assertNotIn('tags', product)
+        self.assertIn('unit_price', product)
+        self.assertFalse(any('description' in sql or 'tags_' in sql for sql in queries))
+
+    def test_unknown_fields_are_ignored(self):
+        response, _ = self.get(fields='id,password')
+        self.assertEqual(set(response.data['results'][0]), {'id'})
+
+
+class ProductTagTests(TestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title='Collection')
+        self.products = create_products(self.collection, 3)
+        self.red = Tag.objects.create(label='red')
+        self.blue = Tag.objects.create(label='blue')
+        self.tag(self.products[0], self.red, self.blue)
+        self.tag(self.products[1], self.blue)
+        # Signed-in requests skip the catalog cache, so every page hits the database.
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='user', email='user@domain.com'))
+
+    def tag(self, product, *tags):
+        TaggedItem.objects.bulk_create([TaggedItem(tag=tag, content_object=product) for tag in tags])
+
+    def get(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/store/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries]
+
+    def test_tag_filter(self):
+        response, _ = self.get(tag=self.red.id)
+        self.assertEqual([row['id'] for row in response.data['results']], [self.products[0].id])
+
+        response, _ = self.get(tag=self.blue.id)
+        self.assertEqual({row['id'] for row in response.data['results']}, {self.products[0].id, self.products[1].id})
+
+        response, _ = self.get(tag=Tag.objects.create(label='green').id)
+        self.assertEqual(response.data['results'], [])
+
+    def test_rows_carry_their_tags(self):
+        response, _ = self.get()
+        tags = {row['id']: {tag['label'] for tag in row['tags']} for row in response.data['results']}
+        self.assertEqual(tags, {
+            self.products[0].id: {'red', 'blue'},
+            self.products[1].id: {'blue'},
+            self.products[2].id: set(),
+        })
+
+    def test_tags_take_one_query_per_page(self):
+        self.get()  # Warms the content type cache.
+        _, small_page = self.get()
+
+        for product in create_products(self.collection, 7):
+            self.tag(product, self.red)
+        response, large_page = self.get()
+
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(large_page), len(small_page))
+        self.assertEqual(len([sql for sql in large_page if 'tags_taggeditem' in sql]), 1)
+
+    def test_filtered_pages_also_take_one_tag_query(self):
+        for product in create_products(self.collection, 7):
+            self.tag(product, self.red)
+        self.get()
+        response, queries = self.get(tag=self.red.id)
+        self.assertEqual(len(response.data['results']), 8)
+        # One subquery filters the page, one query loads the tags for it.
+        self.assertEqual(len([sql for sql in queries if 'tags_taggeditem' in sql]), 2)
+
+
+class ProductValuesSerializerTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.products = [
+            Product.objects.create(
+                title=f'Product {i}', slug='product', description=description, unit_price=unit_price,
+                inventory=10, collection=collection)
+            for i, (unit_price, description) in enumerate([
+                (Decimal('9.99'), 'Description'),
+                (Decimal(10), None),
+                (Decimal('1.05'), ''),
+                (Decimal('9999.99'), 'Description'),
+            ])
+        ]
+        first, second, third, _ = self.products
+        # 15% off 9.99 and 1.05 rounds half up to a cent.
+        promotion = Promotion.objects.create(description='Sale', discount=0.15)
+        promotion.product_set.add(first, third)
+        Promotion.objects.create(description='Small sale', discount=0.05).product_set.add(first)
+        for label in ['Red', 'Blue']:
+            TaggedItem.objects.create(tag=Tag.objects.create(label=label), content_object=first)
+        # The others keep a null last_review_date.
+        Review.objects.create(product=second, name='Name', description='Description')
+        self.client = APIClient()
+
+    def assertRowsMatchRetrieve(self, query=''):
+        # Each list row (ProductValuesSerializer) must render to the same
+        # bytes as the retrieve response (ProductSerializer).
+        response = self.client.get(f'/store/products/?page_size=100{query}')
+        self.assertEqual(len(response.data['results']), len(self.products))
+        for row in response.data['results']:
+            with self.subTest(id=row['id'], query=query):
+                expected = self.client.get(f"/store/products/{row['id']}/?{query.lstrip('&')}")
+                self.assertEqual(JSONRenderer().render(row), expected.content)
+
+    def test_output_is_identical_to_product_serializer(self):
+        self.assertRowsMatchRetrieve()
+        self.assertRowsMatchRetrieve('&fields=id,effective_price,price_with_tax,collection,tags')
+        self.assertRowsMatchRetrieve('&omit=description,tags')
+
+    def test_page_size(self):
+        self.assertEqual(len(self.client.get('/store/products/').data['results']), 4)
+        self.assertEqual(len(self.client.get('/store/products/?page_size=2').data['results']), 2)
+        create_products(self.products[0].collection, 1001)
+        self.assertEqual(len(self.client.get('/store/products/?page_size=5000').data['results']), 1000)
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        prices = ['1.00', '1.05', '9.99', '10.00', '19.95', '333.33', '9999.99']
+        self.products = Product.objects.bulk_create([
+            Product(title=f'Product {i}', slug='product', unit_price=Decimal(price), inventory=10, collection=collection)
+            for i, price in enumerate(prices)
+        ])
+        self.client = APIClient()
+
+    def promote(self, discount, products):
+        promotion = Promotion.objects.create(description='Sale', discount=discount)
+        promotion.product_set.add(*products)
+        return promotion
+
+    def sql_prices(self):
+        return dict(Product.objects.with_prices().values_list('id', 'effective_price'))
+
+    def test_sql_and_python_prices_match(self):
+        for discount in [0, 0.05, 0.15, 1 / 3, 0.5, 0.125, 0.999, 1]:
+            with self.subTest(discount=discount):
+                Promotion.objects.all().delete()
+                promotion = self.promote(discount, self.products)
+                # A smaller promotion on some products must not win.
+                self.promote(discount / 2, self.products[::2])
+                self.assertEqual(pricing.get_effective_prices(self.products), self.sql_prices())
+                self.assertEqual(pricing.get_effective_prices(self.products, cached=False), self.sql_prices())
+                promotion.delete()
+
+    def test_filter_and_ordering(self):
+        cheap, _, middle, _, _, expensive, _ = self.products
+        # 9999.99 and 333.33 drop to 3000.00 and 100.00.
+        self.promote(0.7, [self.products[-1], expensive])
+        ids = [row['id'] for row in self.client.get('/store/products/?ordering=effective_price&page_size=100').data['results']]
+        self.assertEqual(ids, sorted(self.sql_prices(), key=lambda product_id: (self.sql_prices()[product_id], product_id)))
+
+        response = self.client.get('/store/products/', {'effective_price__gt': 50, 'effective_price__lt': 200})
+        self.assertEqual([row['id'] for row in response.data['results']], [expensive.id])
+        self.assertEqual(response.data['results'][0]['effective_price'], Decimal('100.00'))
+
+    def test_cart_and_order_totals(self):
+        product = self.products[2]
+        self.promote(0.15, [product])
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=product, quantity=3)
+        # 9.99 * 0.85 = 8.4915, so 8.49 a unit.
+        self.assertEqual(self.client.get(f'/store/carts/{cart.id}/').data['total_price'], Decimal('25.47'))
+        self.assertEqual(self.client.get(f'/store/carts/{cart.id}/summary/').data['total_price'], Decimal('25.47'))
+
+        user = User.objects.create(username='user', email='user@domain.com')
+        self.client.force_authenticate(user)
+        response = self.client.post('/store/orders/', {'cart_id': str(cart.id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OrderItem.objects.get(order_id=response.data['id']).unit_price, Decimal('8.49'))
+        self.assertEqual(Order.objects.filter(pk=response.data['id']).totals(), {response.data['id']: Decimal('25.47')})
+
+    def test_cached_discounts_follow_promotion_changes(self):
+        product = self.products[3]
+        self.assertEqual(pricing.get_effective_prices([product]), {product.id: Decimal('10.00')})
+        promotion = self.promote(0.2, [product])
+        self.assertEqual(pricing.get_effective_prices([product]), {product.id: Decimal('8.00')})
+        promotion.discount = 0.5
+        promotion.save()
+        self.assertEqual(pricing.get_effective_prices([product]), {product.id: Decimal('5.00')})
+        promotion.product_set.remove(product)
+        self.assertEqual(pricing.get_effective_prices([product]), {product.id: Decimal('10.00')})
+        product.promotions.add(promotion)
+        product.promotions.clear()
+        self.assertEqual(pricing.get_effective_prices([product]), {product.id: Decimal('10.00')})
+
+        # A change made through another worker reaches this one's entries
+        # through the shared catalog version alone.
+        Product.promotions.through.objects.create(product=product, promotion=promotion)
+        self.assertEqual(pricing.get_effective_prices([product]), {product.id: Decimal('10.00')})
+        CatalogCache().bump_version()
+        self.assertEqual(pricing.get_effective_prices([product]), {product.id: Decimal('5.00')})
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Collection')
+        self.lamp = Product.objects.create(
+            title='Desk lamp', description='A small light', slug='lamp',
+            unit_price=Decimal(20), inventory=10, collection=collection)
+        self.shade = Product.objects.create(
+            title='Shade', description='Fits any desk lamp', slug='shade',
+            unit_price=Decimal(5), inventory=10, collection=collection)
+        self.client = APIClient()
+
+    def search(self, query):
+        response = self.client.get('/store/products/', {'search': query})
+        return [row['id'] for row in response.data['results']]
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('lamp'), [self.lamp.id, self.shade.id])
+        self.assertEqual(self.search('light'), [self.lamp.id])
+
+    def test_index_follows_product_changes(self):
+        self.shade.title = 'Lampshade'
+        self.shade.description = ''
+        self.shade.save()
+        self.assertEqual(self.search('lamp'), [self.lamp.id])
+        self.assertEqual(self.search('lampshade'), [self.shade.id])
+
+    def test_index_follows_bulk_writes(self):
+        chair, = Product.objects.bulk_create([Product(
+            title='Chair', description='Matches the desk', slug='chair',
+            unit_price=Decimal(50), inventory=10, collection=self.lamp.collection)])
+        self.assertEqual(self.search('chair'), [chair.id])
+
+        # The filter no longer matches once the title has changed.
+        Product.objects.filter(title='Shade').update(title='Lampshade')
+        Product.objects.filter(pk=chair.id).update(description='')
+        self.assertEqual(self.search('lampshade'), [self.shade.id])
+        self.assertEqual(self.search('desk'), [self.lamp.id, self.shade.id])
+
+        Product.objects.bulk_update([Product(pk=chair.id, title='Stool')], ['title'])
+        self.assertEqual(self.search('stool'), [chair.id])
+        self.assertEqual(self.search('chair'), [])
+
+    def test_rebuild_replaces_terms_batch_by_batch(self):
+        ProductSearchTerm.objects.filter(product=self.shade).delete()
+        ProductSearchTerm.objects.create(product=self.lamp, term='stale', weight=1)
+        expected = set(ProductSearchTerm.objects.filter(product=self.lamp).exclude(term='stale').values_list('term', 'weight'))
+
+        self.assertEqual(InvertedIndexBackend().rebuild(batch_size=1), 2)
+        self.assertEqual(set(ProductSearchTerm.objects.filter(product=self.lamp).values_list('term', 'weight')), expected)
+        self.assertEqual(self.search('lamp'), [self.lamp.id, self.shade.id])
+
+
+@benchmark
+class SearchBenchmark(TestCase):
+    products = int(os.environ.get('BENCHMARK_PRODUCTS', 20000))
+
+    @classmethod
+    def setUpTestData(cls):
+        generator = random.Random(0)
+        words = [''.join(generator.choices('abcdefghijklmnopqrstuvwxyz', k=6)) for _ in range(5000)]
+        collection = Collection.objects.create(title='Collection')
+        Product.objects.bulk_create([
+            Product(
+                title=' '.join(generator.choices(words, k=3)),
+                description=' '.join(generator.choices(words, k=40)),
+                slug='product', unit_price=Decimal(10), inventory=10, collection=collection
+            ) for _ in range(cls.products)
+        ], batch_size=5000)
+        InvertedIndexBackend().rebuild()
+        cls.queries = generator.sample(words, 20)
+
+    def test_index_vs_search_filter(self):
+        backend = InvertedIndexBackend()
+        queryset = Product.objects.all()
+        # The first page of each, as the list endpoint fetches it.
+        searches = {
+            'SearchFilter (icontains)': lambda query: list(
+                queryset.filter(Q(title__icontains=query) | Q(description__icontains=query))
+                .order_by('title', 'id')[:10]
+            ),
+            'InvertedIndexBackend': lambda query: list(
+                backend.search(queryset, query).order_by('-search_rank', 'id')[:10]
+            ),
+        }
+        print(f'\nSearch over {self.products} products, {len(self.queries)} single-term queries')
+        for label, search in searches.items():
+            elapsed = timed(lambda: [search(query) for query in self.queries], repeat=5) / len(self.queries)
+            print(f'  {label:>25}: {elapsed:7.2f} ms/query')
+
+
+@benchmark
+class PaginationBenchmark(TestCase):
+    products = int(os.environ.get('BENCHMARK_PRODUCTS', 100010))
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        create_products(collection, cls.products)
+        cls.user = User.objects.create(username='user', email='user@domain.com')
+
+    def test_page_1_vs_page_10000(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        page_size = 10
+        depth = min(10000, self.products // page_size) - 1
+        title, product_id = Product.objects.order_by('title', 'id').values_list('title', 'id')[depth * page_size - 1]
+
+        urls = {
+            'page 1': '/store/products/',
+            f'page {depth + 1}': f'/store/products/?cursor={encode_cursor([title, product_id])}',
+        }
+        print(f'\nKeyset pagination over {self.products} products')
+        for label, url in urls.items():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(client.get(url).status_code, 200)
+            query_count = len(queries)
+            elapsed = timed(lambda: client.get(url))
+            print(f'  {label:>12}: {elapsed:7.2f} ms/request, {query_count} queries')
+
+        # What the old PageNumberPagination paid for the same pages.
+        queryset = Product.objects.order_by('title', 'id')
+        for page in [1, depth + 1]:
+            offset = (page - 1) * page_size
+            elapsed = timed(lambda: (queryset.count(), list(queryset[offset:offset + page_size])))
+            print(f'  COUNT + OFFSET page {page:>5}: {elapsed:7.2f} ms/query pair')
+
+
+@benchmark
+class AuthenticationBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        products = create_products(collection, 3)
+        cls.user = User.objects.create(username='user', email='user@domain.com')
+        orders = Order.objects.bulk_create([Order(customer=cls.user.customer) for _ in range(10)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, unit_price=product.unit_price)
+            for order in orders
+            for product in products
+        ])
+
+    def test_cached_user_vs_lookup(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+        setups = {
+            'JWTAuthentication': [mock.patch.object(CachedJWTAuthentication, 'get_user', JWTAuthentication.get_user)],
+            'CachedJWTAuthentication': [],
+        }
+        for url in ['/auth/users/me/', '/store/orders/']:
+            print(f'\n{url}')
+            for label, patches in setups.items():
+                with ExitStack() as stack:
+                    for patch in patches:
+                        stack.enter_context(patch)
+                    self.assertEqual(client.get(url).status_code, 200)
+                    with CaptureQueriesContext(connection) as queries:
+                        client.get(url)
+                    query_count = len(queries)
+                    elapsed = timed(lambda: client.get(url), repeat=200)
+                print(f'  {label:>24}: {elapsed:6.2f} ms/request, {query_count} queries')
+
+
+@benchmark
+class CustomerPermissionsBenchmark(TestCase):
+    customers = int(os.environ.get('BENCHMARK_CUSTOMERS', 10))
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([
+            User(username=f'user{i}', email=f'user{i}@domain.com') for i in range(cls.customers)
+        ])
+        Customer.objects.bulk_create([Customer(user=user) for user in users])
+        group = Group.objects.create(name='Customer service')
+        group.permissions.add(*Permission.objects.filter(codename__in=['view_customer', 'view_history']))
+        cls.user = User.objects.create(username='admin', email='admin@domain.com')
+        cls.user.groups.add(group)
+
+    def test_customers_throughput(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(self.user)}')
+        setups = {
+            'JWTAuthentication + ModelBackend': [
+                mock.patch.object(CustomerViewSet, 'authentication_classes', [JWTAuthentication]),
+                override_settings(AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend']),
+            ],
+            'cached user + permissions': [],
+        }
+        print(f'\n/store/customers/ with {self.customers} customers')
+        for label, patches in setups.items():
+            with ExitStack() as stack:
+                for patch in patches:
+                    stack.enter_context(patch)
+                self.assertEqual(client.get('/store/customers/').status_code, 200)
+                with CaptureQueriesContext(connection) as queries:
+                    client.get('/store/customers/')
+                query_count = len(queries)
+                elapsed = timed(lambda: client.get('/store/customers/'), repeat=200)
+            print(f'  {label:>32}: {1000 / elapsed:7.1f} requests/s, {query_count} queries')
+
+
+@benchmark
+class ExportMemoryBenchmark(TestCase):
+    products = int(os.environ.get('BENCHMARK_EXPORT_ROWS', 1000000))
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        create_products(collection, cls.products, description='A' * 200)
+
+    def measure(self, output, limit):
+        tracemalloc.start()
+        started = time.perf_counter()
+        rows = 0
+        for _ in export.export('products', output=output):
+            rows += 1
+            if rows == limit:
+                break
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return rows, elapsed, peak
+
+    def test_memory_stays_flat(self):
+        print(f'\nProduct export over {self.products} rows')
+        for output in ['ndjson', 'csv']:
+            for limit in [10000, None]:
+                rows, elapsed, peak = self.measure(output, limit)
+                print(f'  {output:>6}, {rows:>8} rows: peak {peak / 2 ** 20:6.1f} MiB, {rows / elapsed:8.0f} rows/s')
+
+
+@benchmark
+class BulkUpdateBenchmark(TestCase):
+    products = int(os.environ.get('BENCHMARK_PRODUCTS', 5000))
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        cls.product_ids = [product.id for product in create_products(collection, cls.products)]
+        cls.user = User.objects.create(username='admin', email='admin@domain.com', is_staff=True)
+
+    def test_bulk_update_vs_patch(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        print(f'\nRepricing {self.products} products')
+
+        started = time.perf_counter()
+        for offset in range(0, self.products, BulkProductUpdateSerializer.MAX_PRODUCTS):
+            products = [
+                {'id': product_id, 'unit_price': '11.00'}
+                for product_id in self.product_ids[offset:offset + BulkProductUpdateSerializer.MAX_PRODUCTS]
+            ]
+            response = client.patch('/store/products/bulk-update/', {'products': products}, format='json')
+            self.assertEqual(response.status_code, 200)
+        elapsed = time.perf_counter() - started
+        print(f'  {"bulk-update":>22}: {self.products / elapsed:8.0f} products/s')
+
+        # One PATCH per product, as before; sampled rather than run in full.
+        sample = self.product_ids[:min(200, self.products)]
+        started = time.perf_counter()
+        for product_id in sample:
+            response = client.patch(f'/store/products/{product_id}/', {'unit_price': '12.00'}, format='json')
+            self.assertEqual(response.status_code, 200)
+        elapsed = time.perf_counter() - started
+        print(f'  {"PATCH /products/{id}/":>22}: {len(sample) / elapsed:8.0f} products/s')
+
+
+@benchmark
+class SparseFieldsBenchmark(TestCase):
+    products = int(os.environ.get('BENCHMARK_PRODUCTS', 10000))
+
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        create_products(collection, cls.products, description='A' * 2000)
+        cls.user = User.objects.create(username='user', email='user@domain.com')
+
+    def test_payload_and_latency(self):
+        client = APIClient()
+        # Authenticated requests skip the catalog cache, so every request
+        # is rendered from the database.
+        client.force_authenticate(self.user)
+        urls = {
+            'all fields': '/store/products/',
+            'omit=description': '/store/products/?omit=description',
+            'fields=id,title,unit_price': '/store/products/?fields=id,title,unit_price',
+        }
+        print(f'\nProduct list over {self.products} products')
+        for label, url in urls.items():
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            elapsed = timed(lambda: client.get(url), repeat=50)
+            print(f'  {label:>26}: {len(response.content):6} bytes/page, {elapsed:7.2f} ms/request')
+
+
+@benchmark
+class ProductValuesSerializerBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        collection = Collection.objects.create(title='Collection')
+        create_products(collection, 1000, description='Description')
+
+    def test_rows_per_second(self):
+        request = Request(APIRequestFactory().get('/store/products/'))
+        context = {'request': request}
+        value_fields = ProductValuesSerializer.get_value_fields(ProductSerializer.Meta.fields)
+        print('\nProduct list serialization')
+        for page_size in [10, 100, 1000]:
+            products = list(Product.objects.with_prices()[:page_size])
+            rows = list(Product.objects.with_prices().values(*dict.fromkeys(value_fields))[:page_size])
+            tags = TaggedItem.objects.get_tags_for_many(Product, [product.id for product in products])
+            for product in products:
+                product.tags = tags[product.id]
+            for row in rows:
+                row['tags'] = tags[row['id']]
+
+            serializers = {
+                'ProductSerializer': lambda: ProductSerializer(products, many=True, context=context).data,
+                'ProductValuesSerializer': lambda: ProductValuesSerializer(rows, context=context).data,
+            }
+            for label, serialize in serializers.items():
+                elapsed = timed(serialize, repeat=max(5, 2000 // page_size))
+                print(f'  {page_size:>4} rows, {label:>23}: {page_size * 1000 / elapsed:9.0f} rows/s')
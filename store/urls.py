@@ -8,6 +8,8 @@ router.register('collections', views.CollectionViewSet)
 router.register('carts', views.CartViewSet)
 router.register('customers', views.CustomerViewSet)
 router.register('orders', views.OrderViewSet, basename='orders')
+router.register('analytics/sales', views.SalesAnalyticsViewSet, basename='sales-analytics')
+router.register('export', views.ExportViewSet, basename='export')
 
 products_router = routers.NestedDefaultRouter(router, 'products', lookup='product')
 products_router.register('reviews', views.ReviewViewSet, basename='product-reviews')
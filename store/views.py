@@ -1,54 +1,154 @@
-from django.db.models.aggregates import Count
+from django.core.exceptions import ValidationError
+from django.db.models import Max, Prefetch, ProtectedError
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.decorators import action
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, UpdateModelMixin
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
-from .filters import ProductFilter
-from .models import Product, Collection, OrderItem, Review, Cart, CartItem, Customer, Order
-from .pagination import DefaultPagination
+from tags.models import TaggedItem
+from . import analytics, export
+from .cache import CatalogCacheMixin, catalog_cache
+from .conditional import ConditionalListMixin, ConditionalRetrieveMixin
+from .filters import ProductFilter, ProductSearchFilter
+from .models import Product, Collection, OrderItem, Review, Cart, CartItem, Customer, CustomerStats, Order
+from .pagination import ProductPagination, OrderPagination, ReviewPagination
 from .permissions import IsAdminOrReadOnly, FullDjangoModelPermissions, ViewCustomerHistoryPermission
-from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer, OrderSerializer, UpdateOrderSerializer, CreateOrderSerializer
+from .serializers import SparseFieldsMixin, ProductSerializer, ProductValuesSerializer, BulkProductUpdateSerializer, BulkProductDeleteSerializer, CollectionSerializer, ReviewSerializer, CartSerializer, CartSummarySerializer, CartItemSerializer, AddCartItemSerializer, BatchAddCartItemSerializer, UpdateCartItemSerializer, CustomerSerializer, CustomerStatsSerializer, OrderSerializer, UpdateOrderSerializer, CreateOrderSerializer, OutOfStockError, SalesQuerySerializer, ExportQuerySerializer
 
 
-class ProductViewSet(ModelViewSet):
-    queryset = Product.objects.all()
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+def get_customer_id(request):
+    # New access tokens carry the customer id (see
+    # core.serializers.TokenObtainPairSerializer); tokens issued before it
+    # was added fall back to a lookup, done at most once per request.
+    customer_id = request.auth.get('customer_id') if request.auth is not None else None
+    if customer_id is not None:
+        return customer_id
+
+    if not hasattr(request, '_customer_id'):
+        request._customer_id = Customer.objects \
+            .filter(user_id=request.user.id) \
+            .values_list('id', flat=True) \
+            .first()
+    return request._customer_id
+
+
+class SparseFieldsViewSetMixin:
+    # Loads only the columns the fields picked by ?fields= / ?omit= need
+    # (see SparseFieldsMixin); filter_queryset runs for lists and get_object.
+    def get_selected_fields(self):
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, SparseFieldsMixin):
+            return None
+        return serializer_class.get_selected_fields(self.request)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        selected = self.get_selected_fields()
+        if selected is None:
+            return queryset
+        return queryset.only(*self.get_serializer_class().get_model_fields(selected))
+
+
+class ProductViewSet(SparseFieldsViewSetMixin, CatalogCacheMixin, ConditionalListMixin, ConditionalRetrieveMixin, ModelViewSet):
+    queryset = Product.objects.with_prices()
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     filterset_class = ProductFilter
-    pagination_class = DefaultPagination
+    pagination_class = ProductPagination
     permission_classes = [IsAdminOrReadOnly]
-    search_fields = ['title', 'description']
-    ordering_fields = ['unit_price', 'last_update']
+    ordering_fields = ['unit_price', 'effective_price', 'last_update']
 
     serializer_class = ProductSerializer
 
     def get_serializer_context(self):
         return {'request': self.request}
+
+    def get_validators(self, request, *args, **kwargs):
+        if self.action == 'retrieve':
+            last_update = Product.objects.filter(pk=kwargs['pk']).values_list('last_update', flat=True).first()
+            return None if last_update is None else (last_update.isoformat(), last_update)
+        # Every change to the catalog bumps its version (see
+        # store.signals.handlers), so lists are validated without a query.
+        return catalog_cache.get_version(), None
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action == 'list':
+            return ProductValuesSerializer(*args, many=True, context=self.get_serializer_context())
+        return super().get_serializer(*args, **kwargs)
+
+    def paginate_queryset(self, queryset):
+        # List pages are read as plain rows for ProductValuesSerializer; the
+        # cursor needs the ordering fields (and any search rank) too.
+        selected = self.get_selected_fields()
+        ordering = self.paginator.get_ordering(self.request, queryset, self)
+        value_fields = ProductValuesSerializer.get_value_fields(ProductSerializer.Meta.fields if selected is None else selected)
+        value_fields += [order.lstrip('-') for order in ordering]
+        value_fields += list(queryset.query.annotations)
+        queryset = queryset.values(*dict.fromkeys(value_fields))
+
+        page = super().paginate_queryset(queryset)
+        if page is not None and (selected is None or 'tags' in selected):
+            tags = TaggedItem.objects.get_tags_for_many(Product, [row['id'] for row in page])
+            for row in page:
+                row['tags'] = tags[row['id']]
+        return page
     
     def destroy(self, request, *args, **kwargs):
-        if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
+        if OrderItem.objects.filter(product_id=kwargs['pk']).exists():
             return Response({"error": "Product cannot be deleted becuase it's associated with an orderitem."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(request, *args, **kwargs)
 
+    @action(detail=False, methods=['PATCH'], url_path='bulk-update', permission_classes=[IsAdminUser])
+    def bulk_update(self, request):
+        serializer = BulkProductUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'results': serializer.save()})
+
+    @action(detail=False, methods=['POST'], url_path='bulk-delete', permission_classes=[IsAdminUser])
+    def bulk_delete(self, request):
+        serializer = BulkProductDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            results = serializer.save()
+        except ProtectedError:
+            return Response({"error": "Some products were ordered while deleting them, please try again."}, status=status.HTTP_409_CONFLICT)
+        return Response({'results': results})
+
+    @action(detail=False, methods=['GET'], url_path='cache-stats', permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        # Counters are kept per worker process, so each worker reports its own.
+        return Response({**catalog_cache.stats(), 'version': catalog_cache.get_version()})
+
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(product_count=Count('products')).all()
+class CollectionViewSet(SparseFieldsViewSetMixin, ConditionalListMixin, ConditionalRetrieveMixin, ModelViewSet):
+    queryset = Collection.objects.all()
     permission_classes = [IsAdminOrReadOnly]
     serializer_class = CollectionSerializer
 
+    def get_validators(self, request, *args, **kwargs):
+        if self.action == 'retrieve':
+            last_update = Collection.objects.filter(pk=kwargs['pk']).values_list('last_update', flat=True).first()
+            return None if last_update is None else (last_update.isoformat(), last_update)
+        return catalog_cache.get_version(), None
+
     def get_serializer_context(self):
         return {'request': self.request}
     
     def destroy(self, request, *args, **kwargs):
-        if Product.objects.filter(collection=kwargs['pk']).count() > 0:
+        if Product.objects.filter(collection=kwargs['pk']).exists():
             return Response({"error": "Collection cannot be deleted becuase it's associated with a product."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(request, *args, **kwargs)
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(SparseFieldsViewSetMixin, ModelViewSet):
+    pagination_class = ReviewPagination
+
     def get_queryset(self):
         product_id = self.kwargs['product_pk']
         return Review.objects.filter(product_id=product_id)
@@ -56,19 +156,49 @@ class ReviewViewSet(ModelViewSet):
     serializer_class = ReviewSerializer
 
     def get_serializer_context(self):
-        return {'product_id': self.kwargs['product_pk']}
+        return {'request': self.request, 'product_id': self.kwargs['product_pk']}
 
 
 class CartViewSet(CreateModelMixin,
+                  ConditionalRetrieveMixin,
                   RetrieveModelMixin,
                   DestroyModelMixin,
                   GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+    queryset = Cart.objects \
+        .with_totals() \
+        .prefetch_related(
+            Prefetch('items', queryset=CartItem.objects.select_related('product').with_total_price())
+        )
     serializer_class = CartSerializer
 
+    def get_validators(self, request, *args, **kwargs):
+        # Item changes touch Cart.updated_at; price changes show up in the
+        # products' last_update.
+        cart = Cart.objects \
+            .filter(pk=kwargs['pk']) \
+            .annotate(products_updated=Max('items__product__last_update')) \
+            .values_list('updated_at', 'products_updated') \
+            .first()
+        if cart is None:
+            return None
+        updated_at, products_updated = cart
+        last_modified = max(updated_at, products_updated or updated_at)
+        return f'{updated_at.isoformat()}|{products_updated}', last_modified
+
     def get_serializer_context(self):
         return {'request': self.request}
 
+    @action(detail=True)
+    def summary(self, request, pk):
+        try:
+            cart = Cart.objects.filter(pk=pk).with_totals().values('id', 'item_count', 'total_price').first()
+        except ValidationError:
+            # Not a UUID; retrieve answers these with a 404 as well.
+            cart = None
+        if cart is None:
+            raise NotFound()
+        return Response(CartSummarySerializer(cart).data)
+
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
@@ -77,10 +207,13 @@ class CartItemViewSet(ModelViewSet):
         cart_id = self.kwargs['cart_pk']
         return CartItem.objects \
                .filter(cart_id=cart_id) \
-               .select_related('product')
+               .select_related('product') \
+               .with_total_price()
     
     def get_serializer_class(self):
-        if self.request.method == 'POST':
+        if self.action == 'batch':
+            return BatchAddCartItemSerializer
+        elif self.request.method == 'POST':
             return AddCartItemSerializer
         elif self.request.method == 'PATCH':
             return UpdateCartItemSerializer
@@ -90,6 +223,29 @@ class CartItemViewSet(ModelViewSet):
     def get_serializer_context(self):
         return {'cart_id': self.kwargs['cart_pk']}
 
+    # Every change to the items counts as activity on the cart;
+    # see the purge_carts command.
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        Cart.touch(self.kwargs['cart_pk'])
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        Cart.touch(self.kwargs['cart_pk'])
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        Cart.touch(self.kwargs['cart_pk'])
+
+    @action(detail=False, methods=['POST'])
+    def batch(self, request, cart_pk):
+        serializer = BatchAddCartItemSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        cart_items = serializer.save()
+        Cart.touch(cart_pk)
+        serializer = CartItemSerializer(cart_items, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 class CustomerViewSet(ModelViewSet):
     queryset = Customer.objects.all()
@@ -99,11 +255,18 @@ class CustomerViewSet(ModelViewSet):
 
     @action(detail=True, permission_classes=[ViewCustomerHistoryPermission])
     def history(self, request, pk):
-        return Response('ok')
+        stats = CustomerStats.objects.filter(customer_id=pk).first()
+        if stats is None:
+            # Customers without orders have no stats row yet.
+            if not Customer.objects.filter(pk=pk).exists():
+                raise NotFound()
+            stats = CustomerStats(customer_id=pk)
+        serializer = CustomerStatsSerializer(stats)
+        return Response(serializer.data)
 
     @action(detail=False, methods=['GET', 'PUT'], permission_classes=[IsAuthenticated])
     def me(self, request):
-        customer = Customer.objects.get(user_id=request.user.id)
+        customer = Customer.objects.get(pk=get_customer_id(request))
         if request.method == 'GET':
             serializer = CustomerSerializer(customer)
             return Response(serializer.data)
@@ -114,8 +277,9 @@ class CustomerViewSet(ModelViewSet):
             return Response(serializer.data)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(SparseFieldsViewSetMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    pagination_class = OrderPagination
     
     def get_permissions(self):
         if self.request.method in ['PATCH', 'DELETE']:
@@ -125,19 +289,26 @@ class OrderViewSet(ModelViewSet):
     def get_queryset(self):
         user = self.request.user
 
+        queryset = Order.objects.all()
+        selected = self.get_selected_fields()
+        if selected is None or {'items', 'total_price'} & set(selected):
+            queryset = queryset.prefetch_related('items__product')
         if user.is_staff:
-            return Order.objects.all()
+            return queryset
 
-        customer_id = Customer.objects.only('id').get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id)
+        return queryset.filter(customer_id=get_customer_id(self.request))
     
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(
                          data=request.data,
-                         context={'user_id': self.request.user.id}                        
+                         context={'customer_id': get_customer_id(self.request)}                        
                      )
         serializer.is_valid(raise_exception=True)
-        order = serializer.save()
+        try:
+            order = serializer.save()
+        except OutOfStockError as error:
+            return Response({"error": str(error), "items": error.items}, status=status.HTTP_409_CONFLICT)
+        order = Order.objects.prefetch_related('items__product').get(pk=order.pk)
         serializer = OrderSerializer(order)
         return Response(serializer.data)
     
@@ -147,3 +318,51 @@ class OrderViewSet(ModelViewSet):
         elif self.request.method == 'PATCH':
             return UpdateOrderSerializer
         return OrderSerializer
+
+
+class SalesAnalyticsViewSet(GenericViewSet):
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        query = SalesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(analytics.get_sales(**query.validated_data))
+
+
+class ExportContentNegotiation(BaseContentNegotiation):
+    # Exports pick their format from ?output= and stream it themselves, so
+    # an Accept header like text/csv mustn't end in a 406; errors are JSON.
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ExportViewSet(GenericViewSet):
+    permission_classes = [IsAdminUser]
+    content_negotiation_class = ExportContentNegotiation
+    renderer_classes = [JSONRenderer]
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    @action(detail=False)
+    def products(self, request):
+        return self.stream('products', request)
+
+    @action(detail=False)
+    def orders(self, request):
+        return self.stream('orders', request)
+
+    def stream(self, kind, request):
+        query = ExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        output = query.validated_data['output']
+        response = StreamingHttpResponse(
+            export.export(kind, output=output, since=query.validated_data.get('since')),
+            content_type=self.content_types[output]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{output}"'
+        return response
@@ -146,12 +146,63 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     "COERCE_DECIMAL_TO_STRING": False,
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
     ),
 }
 
 AUTH_USER_MODEL = 'core.User'
 
+AUTHENTICATION_BACKENDS = [
+    'core.backends.CachedModelBackend',
+]
+
+# Caches that every worker has to see alike live in Redis. Without
+# REDIS_URL they fall back to LocMemCache, which is only correct for a
+# single process (runserver, tests).
+REDIS_URL = config('REDIS_URL', default='')
+
+
+def shared_cache(key_prefix, timeout, max_entries):
+    # Redis bounds its memory with maxmemory-policy rather than an entry count.
+    if REDIS_URL:
+        return {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': key_prefix,
+            'TIMEOUT': timeout,
+        }
+    return {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': key_prefix,
+        'TIMEOUT': timeout,
+        'OPTIONS': {
+            'MAX_ENTRIES': max_entries,
+            'CULL_FREQUENCY': 10,
+        },
+    }
+
+
+CACHES = {
+    # Shared state such as the catalog version (see store.cache).
+    'default': shared_cache('default', timeout=300, max_entries=1000),
+    # Anonymous product list/retrieve responses, kept per worker under the
+    # shared catalog version. LocMemCache evicts in LRU order once
+    # MAX_ENTRIES is reached.
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+    # Authenticated users and their permission sets (see core.authentication
+    # and core.backends). Evictions and permission version bumps have to
+    # reach every worker, so this is a shared cache.
+    'users': shared_cache('users', timeout=300, max_entries=10000),
+}
+
 DJOSER = {
     'SERIALIZERS': {
         'user_create': 'core.serializers.UserCreateSerializer',
@@ -159,6 +210,9 @@ DJOSER = {
     }
 }
 
+# Models that can be liked through the likes API, as "app_label.model".
+LIKEABLE_MODELS = ['store.product']
+
 # Settings for Simple-jwt
 SIMPLE_JWT = {
     # "ACCESS_TOKEN_LIFETIME": timedelta(minutes=5),
@@ -192,7 +246,7 @@ SIMPLE_JWT = {
     # "SLIDING_TOKEN_LIFETIME": timedelta(minutes=5),
     # "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
-    # "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
+    'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.TokenObtainPairSerializer',
     # "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
     # "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
     # "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
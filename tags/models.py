@@ -14,6 +14,21 @@ class TaggedItemManager(models.Manager):
                 object_id=obj_id
             )
 
+    def get_tags_for_many(self, obj_type, obj_ids):
+        content_type = ContentType.objects.get_for_model(obj_type)
+
+        tagged_items = TaggedItem.objects \
+            .select_related('tag') \
+            .filter(
+                content_type=content_type,
+                object_id__in=obj_ids
+            )
+
+        tags = {obj_id: [] for obj_id in obj_ids}
+        for tagged_item in tagged_items:
+            tags[tagged_item.object_id].append(tagged_item.tag)
+        return tags
+
 
 class Tag(models.Model):
     label = models.CharField(max_length=255)
@@ -28,3 +43,9 @@ class TaggedItem(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id']),
+            models.Index(fields=['tag', 'content_type']),
+        ]